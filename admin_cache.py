@@ -0,0 +1,61 @@
+import logging
+import time
+from pyrogram import enums
+from pyrogram.errors import FloodWait, RPCError
+from cache import SingleFlight, TTLCache
+from metrics import FLOOD_WAITS
+from config import ADMIN_CACHE_TTL, ADMIN_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (enums.ChatMemberStatus.OWNER, enums.ChatMemberStatus.ADMINISTRATOR)
+
+# Stale admin lists are kept this much longer than the TTL to ride out FloodWaits
+STALE_FACTOR = 10
+
+class AdminCache:
+    """Per-chat admin ID sets, loaded in bulk and kept until the TTL or a member update"""
+
+    def __init__(self, ttl=ADMIN_CACHE_TTL, maxsize=ADMIN_CACHE_SIZE):
+        self.ttl = ttl
+        # chat_id -> (loaded_at, set of admin user IDs)
+        self.entries = TTLCache(maxsize, ttl * STALE_FACTOR)
+        self.loads = SingleFlight()
+
+    async def get(self, client, chat_id):
+        """Admin user IDs of a chat, fetched at most once per TTL"""
+        entry = self.entries.get(chat_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        try:
+            # Many clicks in the same chat share a single get_chat_members call
+            return await self.loads.run(chat_id, lambda: self._load(client, chat_id))
+        except FloodWait as e:
+            FLOOD_WAITS.inc(source='admin_check')
+            logger.warning(f"FloodWait {e.value}s while loading admins of {chat_id}, "
+                           f"{'using stale list' if entry else 'denying admin commands'}")
+            return entry[1] if entry else set()
+        except RPCError as e:
+            logger.warning(f"Could not load admins of {chat_id}: {e}")
+            return entry[1] if entry else set()
+
+    async def _load(self, client, chat_id):
+        admins = set()
+        async for member in client.get_chat_members(chat_id, filter=enums.ChatMembersFilter.ADMINISTRATORS):
+            if member.user and member.status in ADMIN_STATUSES:
+                admins.add(member.user.id)
+        self.entries.set(chat_id, (time.monotonic(), admins))
+        return admins
+
+    def update_member(self, chat_id, user_id, is_admin):
+        """Apply a chat-member update to the cached list in place (no RPC needed)"""
+        entry = self.entries.peek(chat_id)
+        if not entry:
+            return
+        if is_admin:
+            entry[1].add(user_id)
+        else:
+            entry[1].discard(user_id)
+
+# Global instance
+admin_cache = AdminCache()
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from pyrogram import Client
+from pyrogram.errors import UserAlreadyParticipant, UserNotParticipant, PeerIdInvalid, ChannelInvalid, ChannelPrivate
+from pytgcalls import PyTgCalls
+from metrics import registry, labels, Gauge
+from config import API_ID, API_HASH, MAX_CALLS_PER_ASSISTANT
+
+logger = logging.getLogger(__name__)
+
+DISCONNECT_COOLDOWN = 60  # seconds a disconnected assistant gets no new chats
+
+# What the membership check raises for a session that is not in the chat; a new session that has never met
+# the chat cannot even resolve its ID, so it gets the peer errors instead of UserNotParticipant
+NOT_A_MEMBER = (UserNotParticipant, PeerIdInvalid, ChannelInvalid, ChannelPrivate)
+
+class AssistantNotInChat(Exception):
+    """The assistant has to join the chat first but no invite link is available"""
+
+class Assistant:
+    """One user session with its own PyTgCalls instance"""
+
+    def __init__(self, index, client, calls, is_bot=False):
+        self.index = index
+        self.client = client
+        self.calls = calls
+        self.is_bot = is_bot
+        self.chats = set()
+        self.joined = set()
+        self.cooldown_until = 0.0
+        self.connected = True
+
+    @property
+    def available(self):
+        return self.connected and time.monotonic() >= self.cooldown_until
+
+    def __repr__(self):
+        return f"assistant#{self.index}"
+
+class AssistantPool:
+    """Spreads voice chats over several assistant sessions: least-loaded, sticky, with failover"""
+
+    def __init__(self, max_calls=MAX_CALLS_PER_ASSISTANT):
+        self.assistants = []
+        self.assignments = {}
+        self.max_calls = max_calls
+
+    def add(self, client, calls, is_bot=False):
+        assistant = Assistant(len(self.assistants), client, calls, is_bot)
+        self.assistants.append(assistant)
+        return assistant
+
+    def add_sessions(self, session_strings, prefix="assistant"):
+        """Create a client and PyTgCalls instance for each user session string"""
+        for session_string in session_strings:
+            client = Client(
+                f"{prefix}{len(self.assistants)}",
+                api_id=API_ID,
+                api_hash=API_HASH,
+                session_string=session_string
+            )
+            self.add(client, PyTgCalls(client))
+
+    def __iter__(self):
+        return iter(self.assistants)
+
+    def for_chat(self, chat_id):
+        """Assistant serving a chat; new chats go to the least-loaded available one"""
+        assistant = self.assignments.get(chat_id)
+        if assistant is not None:
+            return assistant
+        candidates = [a for a in self.assistants if a.available and len(a.chats) < self.max_calls]
+        if not candidates:
+            # Everyone is cooling down or full: least-bad choice rather than refusing
+            candidates = [a for a in self.assistants if a.connected] or self.assistants
+        assistant = min(candidates, key=lambda a: (len(a.chats), a.cooldown_until))
+        self.assignments[chat_id] = assistant
+        assistant.chats.add(chat_id)
+        return assistant
+
+    def calls_for(self, chat_id):
+        """PyTgCalls instance of the chat's current assistant (without assigning one)"""
+        assistant = self.assignments.get(chat_id)
+        return (assistant or self.assistants[0]).calls
+
+    def release(self, chat_id):
+        """Forget the assignment once the chat's call has ended"""
+        assistant = self.assignments.pop(chat_id, None)
+        if assistant:
+            assistant.chats.discard(chat_id)
+
+    def failover(self, chat_id, flood_wait=None):
+        """Take a chat away from its assistant after a FloodWait or disconnect and pick another"""
+        assistant = self.assignments.get(chat_id)
+        if assistant is None:
+            return self.for_chat(chat_id)
+        if flood_wait is not None:
+            assistant.cooldown_until = time.monotonic() + flood_wait
+            logger.warning(f"{assistant} hit FloodWait {flood_wait}s, moving {chat_id}")
+        else:
+            # Reconnects on its own; just keep new chats away for a while
+            assistant.cooldown_until = time.monotonic() + DISCONNECT_COOLDOWN
+            logger.warning(f"{assistant} is disconnected, moving {chat_id}")
+        self.release(chat_id)
+        replacement = self.for_chat(chat_id)
+        return replacement if replacement is not assistant else None
+
+    async def ensure_joined(self, assistant, chat_id, get_invite_link):
+        """Make sure a user-session assistant is a member of the chat (joins via an invite link)"""
+        if assistant.is_bot or chat_id in assistant.joined:
+            return
+        try:
+            await assistant.client.get_chat_member(chat_id, "me")
+        except NOT_A_MEMBER:
+            link = await get_invite_link()
+            try:
+                await assistant.client.join_chat(link)
+            except UserAlreadyParticipant:
+                pass
+            logger.info(f"{assistant} joined {chat_id}")
+        assistant.joined.add(chat_id)
+
+    async def start(self):
+        """Start every assistant's client and PyTgCalls instance concurrently"""
+        results = await asyncio.gather(*(a.calls.start() for a in self.assistants), return_exceptions=True)
+        for assistant, result in zip(self.assistants, results):
+            if isinstance(result, Exception):
+                assistant.connected = False
+                logger.error(f"Failed to start {assistant}: {result}")
+        logger.info(f"{sum(a.connected for a in self.assistants)}/{len(self.assistants)} assistants ready")
+
+    def status(self):
+        return [{
+            'assistant': assistant.index,
+            'calls': len(assistant.chats),
+            'available': assistant.available
+        } for assistant in self.assistants]
+
+# Global instance
+assistants = AssistantPool()
+
+registry.register(Gauge('musicbot_assistant_calls', 'Voice chats assigned to each assistant', function=lambda: {
+    labels(assistant=str(a.index)): len(a.chats) for a in assistants
+}))
+registry.register(Gauge('musicbot_assistant_available', 'Whether each assistant accepts new chats', function=lambda: {
+    labels(assistant=str(a.index)): int(a.available) for a in assistants
+}))
@@ -0,0 +1,131 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+from collections import OrderedDict
+from cache import TTLCache
+from extractor import download_audio
+from metrics import registry, labels, Counter, Gauge
+from config import (DOWNLOAD_DIR, MAX_DOWNLOAD_SIZE, ENABLE_AUDIO_CACHE, AUDIO_CACHE_MIN_PLAYS,
+                    AUDIO_CACHE_MAX_DURATION)
+
+logger = logging.getLogger(__name__)
+
+class AudioCache:
+    """Size-bounded on-disk LRU of frequently played tracks, keyed by video ID"""
+
+    def __init__(self, directory=DOWNLOAD_DIR, max_bytes=MAX_DOWNLOAD_SIZE * 1024 * 1024,
+                 enabled=ENABLE_AUDIO_CACHE, min_plays=AUDIO_CACHE_MIN_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.min_plays = min_plays
+        # video_id -> (path, size), least recently played first
+        self.files = OrderedDict()
+        self.total_bytes = 0
+        # Recent play counts decide what is worth downloading
+        self.plays = TTLCache(20000, 7 * 24 * 3600)
+        self.downloading = set()
+        # One download at a time so caching never competes with /play extractions
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="audio-cache")
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Index files left from previous runs (oldest first) and trim to the size limit"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(('.part', '.ytdl')):
+                # Interrupted download
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            found.append((stat.st_mtime, entry.name.split('.', 1)[0], entry.path, stat.st_size))
+        for _, video_id, path, size in sorted(found):
+            self._add(video_id, path, size)
+        self._evict()
+        logger.info(f"Audio cache: {len(self.files)} tracks, {self.total_bytes / 2**20:.0f}/{self.max_bytes / 2**20:.0f} MB")
+
+    def lookup(self, video_id):
+        """Local file for a track, marked as recently played, or None"""
+        if not self.enabled or not video_id:
+            return None
+        entry = self.files.get(video_id)
+        if entry is None or not os.path.exists(entry[0]):
+            if entry:
+                self._remove(video_id)
+            self.misses += 1
+            return None
+        self.files.move_to_end(video_id)
+        try:
+            # Keeps the LRU order across restarts
+            os.utime(entry[0])
+        except OSError:
+            pass
+        self.hits += 1
+        return entry[0]
+
+    def record_play(self, song):
+        """Count a play and start caching the track once it is popular enough"""
+        if not self.enabled or not song.video_id or song.source:
+            return
+        if song.video_id in self.files or song.video_id in self.downloading:
+            return
+        if not song.duration or song.duration > AUDIO_CACHE_MAX_DURATION:
+            # Live streams and long mixes would churn the whole cache
+            return
+        plays = (self.plays.get(song.video_id) or 0) + 1
+        self.plays.set(song.video_id, plays)
+        if plays >= self.min_plays:
+            self.downloading.add(song.video_id)
+            asyncio.ensure_future(self._download(song.video_id, song.page_url))
+
+    async def _download(self, video_id, page_url):
+        loop = asyncio.get_running_loop()
+        try:
+            path = await loop.run_in_executor(self.executor, download_audio, page_url, self.max_bytes // 10)
+            if path:
+                self._add(video_id, path, os.path.getsize(path))
+                self._evict()
+                logger.info(f"Cached audio for {video_id} ({os.path.getsize(path) / 2**20:.1f} MB)")
+        except Exception as e:
+            logger.warning(f"Audio cache download failed for {video_id}: {e}")
+        finally:
+            self.downloading.discard(video_id)
+
+    def _add(self, video_id, path, size):
+        if video_id in self.files:
+            self._remove(video_id)
+        self.files[video_id] = (path, size)
+        self.total_bytes += size
+
+    def _remove(self, video_id):
+        path, size = self.files.pop(video_id)
+        self.total_bytes -= size
+        return path
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.files:
+            video_id = next(iter(self.files))
+            path = self._remove(video_id)
+            try:
+                # Safe even if FFmpeg is still reading it; the data goes away when it closes the file
+                os.remove(path)
+            except OSError:
+                pass
+            logger.info(f"Evicted {video_id} from the audio cache")
+
+# Global instance
+audio_cache = AudioCache()
+
+registry.register(Gauge('musicbot_audio_cache_bytes', 'Bytes used by the on-disk audio cache', function=lambda: audio_cache.total_bytes))
+registry.register(Gauge('musicbot_audio_cache_tracks', 'Tracks in the on-disk audio cache', function=lambda: len(audio_cache.files)))
+registry.register(Counter('musicbot_audio_cache_lookups_total', 'On-disk audio cache lookups', function=lambda: {
+    labels(result='hit'): audio_cache.hits,
+    labels(result='miss'): audio_cache.misses
+}))
@@ -0,0 +1,422 @@
+"""Offline load test: the real command handlers against fake Telegram, PyTgCalls and yt-dlp.
+
+Pyrogram's Client, PyTgCalls and yt_dlp.YoutubeDL are replaced by stand-ins with fixed latencies
+before main.py is imported; everything else (handlers, caches, extractor pool, outbox, state store)
+is the real code. Each simulated chat runs the same seeded script of /play, /queue, /skip, the skip
+button and stream ends, many chats at a time. Results are printed as JSON so runs on different
+commits can be diffed.
+
+Run from the repository root:  python benchmarks/load_test.py [--chats 2000] [--output result.json]
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRIPT = ("play", "play", "play", "queue", "skip", "skip_button", "stream_end", "stream_end")
+
+# --- Stand-ins ---
+
+class Latency:
+    connect = 0.0
+    rpc = 0.0
+    call = 0.0
+    extract = 0.0
+
+class FakeUser:
+    def __init__(self, user_id, first_name="User", username=None):
+        self.id = user_id
+        self.first_name = first_name
+        self.username = username
+
+class FakeChat:
+    type = "supergroup"
+
+    def __init__(self, chat_id):
+        self.id = chat_id
+
+class FakeMember:
+    def __init__(self, user, status):
+        self.user = user
+        self.status = status
+
+BOT_USER = FakeUser(1, "Bot", "load_test_bot")
+_message_ids = itertools.count(1)
+
+class FakeMessage:
+    def __init__(self, chat, from_user, text=""):
+        self.id = next(_message_ids)
+        self.chat = chat
+        self.from_user = from_user
+        self.text = text
+        # Pyrogram strips the leading slash and splits on whitespace
+        self.command = text[1:].split() if text.startswith("/") else None
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(Latency.rpc)
+        return FakeMessage(self.chat, BOT_USER, text)
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(Latency.rpc)
+        self.text = text
+        return self
+
+class FakeCallbackQuery:
+    def __init__(self, message, from_user, data):
+        self.message = message
+        self.from_user = from_user
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        await asyncio.sleep(Latency.rpc)
+
+def chat_users(chat_id):
+    return [FakeUser(abs(chat_id) * 10 + k) for k in range(3)]
+
+class FakeClient:
+    """Pyrogram Client: handler decorators are no-ops, RPCs just wait"""
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.is_connected = False
+
+    def _decorator(self, *args, **kwargs):
+        return lambda func: func
+
+    on_message = on_callback_query = on_chat_member_updated = on_inline_query = _decorator
+
+    async def start(self):
+        await asyncio.sleep(Latency.connect)
+        self.is_connected = True
+
+    async def stop(self):
+        self.is_connected = False
+
+    async def get_me(self):
+        return BOT_USER
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(Latency.rpc)
+        return FakeMessage(FakeChat(chat_id), BOT_USER, text)
+
+    async def export_chat_invite_link(self, chat_id):
+        await asyncio.sleep(Latency.rpc)
+        return f"https://t.me/+{abs(chat_id)}"
+
+    async def get_chat_members(self, chat_id, filter=None, **kwargs):
+        from pyrogram import enums
+        await asyncio.sleep(Latency.rpc)
+        for user in chat_users(chat_id):
+            yield FakeMember(user, enums.ChatMemberStatus.ADMINISTRATOR)
+
+class FakePyTgCalls:
+    """PyTgCalls (the pinned 0.9.x API): tracks which chats are in a call, no Node.js or FFmpeg"""
+
+    # Joins and stream changes that succeeded, across all instances
+    streams_started = 0
+
+    def __init__(self, app, *args, **kwargs):
+        self.app = app
+        self.calls = {}
+
+    def on_stream_end(self):
+        return lambda func: func
+
+    async def start(self):
+        if not self.app.is_connected:
+            await self.app.start()
+
+    def _in_call(self, chat_id):
+        from pytgcalls.exceptions import NotInGroupCallError
+        if chat_id not in self.calls:
+            raise NotInGroupCallError()
+
+    async def join_group_call(self, chat_id, stream, invite_hash=None, join_as=None, stream_type=None):
+        from pytgcalls.exceptions import AlreadyJoinedError
+        await asyncio.sleep(Latency.call)
+        if chat_id in self.calls:
+            raise AlreadyJoinedError()
+        self.calls[chat_id] = time.monotonic()
+        FakePyTgCalls.streams_started += 1
+
+    async def change_stream(self, chat_id, stream):
+        await asyncio.sleep(Latency.call)
+        self._in_call(chat_id)
+        self.calls[chat_id] = time.monotonic()
+        FakePyTgCalls.streams_started += 1
+
+    async def leave_group_call(self, chat_id):
+        await asyncio.sleep(Latency.call)
+        self._in_call(chat_id)
+        del self.calls[chat_id]
+
+    async def pause_stream(self, chat_id):
+        await asyncio.sleep(Latency.call)
+        self._in_call(chat_id)
+
+    async def resume_stream(self, chat_id):
+        await asyncio.sleep(Latency.call)
+        self._in_call(chat_id)
+
+    async def played_time(self, chat_id):
+        self._in_call(chat_id)
+        return int(time.monotonic() - self.calls[chat_id])
+
+def fake_video_id(query):
+    return hashlib.md5(query.encode()).hexdigest()[:11]
+
+class FakeYoutubeDL:
+    """yt_dlp.YoutubeDL: blocks its worker thread like a real extraction, then returns a plausible info dict"""
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    def extract_info(self, url, download=False, process=True):
+        time.sleep(Latency.extract)
+        if url.startswith("ytsearch"):
+            count, query = url[len("ytsearch"):].split(":", 1)
+            # Flat /search results carry metadata only; hit n > 1 is a different track for the same query
+            flat = self.params.get("extract_flat")
+            return {"entries": [
+                self._flat(video_id) if flat else self._info(video_id)
+                for video_id in [fake_video_id(query if n == 0 else f"{query}#{n}") for n in range(int(count or 1))]
+            ]}
+        video_id = url.rsplit("v=", 1)[-1][:11]
+        return self._info(video_id)
+
+    def _info(self, video_id):
+        return {
+            "id": video_id,
+            "title": f"Track {video_id}",
+            "duration": 180 + int(video_id[:2], 16),
+            "url": f"https://rr1---sn-fake.googlevideo.com/videoplayback?expire={int(time.time()) + 21600}&id={video_id}",
+            "thumbnail": f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}"
+        }
+
+    def _flat(self, video_id):
+        info = self._info(video_id)
+        return {"id": video_id, "title": info["title"], "duration": info["duration"], "ie_key": "Youtube",
+                "url": info["webpage_url"], "uploader": "Fake Channel"}
+
+    def close(self):
+        pass
+
+def install_fakes(youtube_dl=True):
+    import pyrogram
+    import pytgcalls
+    pyrogram.Client = FakeClient
+    pytgcalls.PyTgCalls = FakePyTgCalls
+    if youtube_dl:
+        import yt_dlp
+        yt_dlp.YoutubeDL = FakeYoutubeDL
+
+# --- Load generation ---
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+def make_scripts(chats, catalog, seed):
+    """Per-chat command lists, fixed by the seed; popular songs repeat across chats"""
+    rng = random.Random(seed)
+    songs = [f"song {i} {''.join(rng.choices('abcdefghij', k=8))}" for i in range(catalog)]
+    scripts = []
+    for n in range(chats):
+        chat_id = -1000000 - n
+        queries = iter([songs[int(rng.random() ** 3 * catalog)] for _ in range(SCRIPT.count("play"))])
+        scripts.append((chat_id, [(step, next(queries) if step == "play" else None) for step in SCRIPT]))
+    return scripts
+
+async def run_step(main, chat, user, step, query):
+    if step == "play":
+        await main.play_command(main.app, FakeMessage(chat, user, f"/play {query}"))
+    elif step == "queue":
+        await main.queue_command(main.app, FakeMessage(chat, user, "/queue"))
+    elif step == "skip":
+        await main.skip_command(main.app, FakeMessage(chat, user, "/skip"))
+    elif step == "skip_button":
+        message = FakeMessage(chat, BOT_USER, "Now Playing")
+        await main.callback_handler(main.app, FakeCallbackQuery(message, user, "skip"))
+    elif step == "stream_end":
+        await main.stream_end_handler(chat.id)
+
+async def run_load(main, scripts, concurrency):
+    latencies = {step: [] for step in SCRIPT}
+    errors = 0
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_chat(chat_id, steps):
+        nonlocal errors
+        chat = FakeChat(chat_id)
+        user = chat_users(chat_id)[0]
+        async with limit:
+            for step, query in steps:
+                started = time.perf_counter()
+                try:
+                    await run_step(main, chat, user, step, query)
+                except Exception:
+                    errors += 1
+                latencies[step].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_chat(chat_id, steps) for chat_id, steps in scripts))
+    elapsed = time.perf_counter() - started
+    return latencies, errors, elapsed
+
+async def drain_outbox(outbox, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not any(queue.jobs or queue.busy for queue in outbox.chats.values()):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(args):
+    import psutil
+    import main
+    from metrics import EXTRACTION_SECONDS
+    from ratelimit import THROTTLED
+    from supervisor import STREAM_RECOVERIES
+    from cache import cache_stats
+
+    await main.backend.start()
+    scripts = make_scripts(args.chats, args.catalog, args.seed)
+    rss_before = psutil.Process().memory_info().rss
+
+    latencies, errors, elapsed = await run_load(main, scripts, args.concurrency)
+    drained = await drain_outbox(main.outbox)
+
+    commands = sum(len(values) for values in latencies.values())
+    extraction_count = sum(state[-1] for state in EXTRACTION_SECONDS.values.values())
+    result = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "chats": args.chats,
+            "concurrency": args.concurrency,
+            "catalog": args.catalog,
+            "seed": args.seed,
+            "rpc_latency_ms": args.rpc_latency,
+            "call_latency_ms": args.call_latency,
+            "extract_latency_ms": args.extract_latency,
+            "telegram_limits": args.telegram_limits
+        },
+        "elapsed_s": round(elapsed, 3),
+        "commands": commands,
+        "errors": errors,
+        # Refused requests (rate limits, and "busy" shedding as overload): their latency is not a real /play
+        "throttled": {dict(key)['scope']: value for key, value in sorted(THROTTLED.values.items())},
+        "throughput_per_s": round(commands / elapsed, 1),
+        "latency_ms": {
+            step: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.50) * 1000, 2),
+                "p99": round(percentile(values, 0.99) * 1000, 2),
+                "max": round(max(values, default=0) * 1000, 2)
+            } for step, values in latencies.items()
+        },
+        "extractions": extraction_count,
+        "songs_played": main.usage.played,
+        # Songs only count as played once PyTgCalls accepted the stream; failures here mean streaming is broken
+        "streams_started": FakePyTgCalls.streams_started,
+        "stream_recoveries": {
+            f"{dict(key)['reason']}:{dict(key)['result']}": value
+            for key, value in sorted(STREAM_RECOVERIES.values.items())
+        },
+        "outbox": {"sent": main.outbox.sent, "coalesced": main.outbox.coalesced, "drained": drained},
+        "cache": cache_stats(),
+        "memory_mb": {
+            "rss_start": round(rss_before / 2**20, 1),
+            "rss_end": round(psutil.Process().memory_info().rss / 2**20, 1),
+            # ru_maxrss is in KiB on Linux
+            "rss_peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+    }
+    main.extractor.shutdown()
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500, help="chats running their script at the same time")
+    parser.add_argument("--catalog", type=int, default=1000, help="distinct songs requested")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rpc-latency", type=float, default=30, help="ms per Telegram RPC")
+    parser.add_argument("--call-latency", type=float, default=50, help="ms per PyTgCalls operation")
+    parser.add_argument("--extract-latency", type=float, default=400, help="ms per yt-dlp extraction (blocking)")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="keep the outbox, throttling and extraction backlog limits instead of lifting them")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    Latency.rpc = args.rpc_latency / 1000
+    Latency.call = args.call_latency / 1000
+    Latency.extract = args.extract_latency / 1000
+
+    # Must be set before config.py is imported
+    os.environ.update({
+        "STATE_BACKEND": "memory",
+        "STREAM_WORKERS": "0",
+        "SESSION_STRINGS": "",
+        "ENABLE_AUDIO_CACHE": "False",
+        "ENABLE_PROFILER": "False"
+    })
+    if not args.telegram_limits:
+        # Measure the bot itself rather than the pacing and load shedding it applies for Telegram
+        os.environ.update({
+            "MAX_EXTRACTION_BACKLOG": "1000000",
+            "OUTBOX_GLOBAL_RATE": "1000000",
+            "OUTBOX_CHAT_RATE": "1000000",
+            "OUTBOX_CHAT_BURST": "1000000",
+            "USER_COMMAND_RATE": "1000000",
+            "USER_COMMAND_BURST": "1000000",
+            "CHAT_COMMAND_RATE": "1000000",
+            "CHAT_COMMAND_BURST": "1000000"
+        })
+    install_fakes()
+
+    # bot.log, downloads/ and the cookie lookup stay out of the working tree
+    workdir = tempfile.mkdtemp(prefix="musicbot-load-")
+    os.chdir(workdir)
+    result = asyncio.run(run(args)) if args.verbose else _quiet(run, args)
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(os.path.join(ROOT, args.output) if not os.path.isabs(args.output) else args.output, "w") as f:
+            f.write(text + "\n")
+
+def _quiet(func, args):
+    # main.py configures logging on import; only errors matter here
+    logging.disable(logging.WARNING)
+    return asyncio.run(func(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Memory used by queued songs: the old dict-backed Song in lists vs the slotted Song in deques.
+
+Run from the repository root:  python benchmarks/queue_memory.py [chats] [tracks_per_chat]
+"""
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from song import Song
+
+class LegacySong:
+    """Song as it was before: per-instance __dict__, signed URL and mention HTML stored"""
+    def __init__(self, title, duration, url, thumbnail, requester, platform="YouTube"):
+        self.title = title
+        self.duration = duration
+        self.url = url
+        self.thumbnail = thumbnail
+        self.requester = requester
+        self.platform = platform
+
+def signed_url(video_id, n):
+    # Roughly the length of a real googlevideo.com playback URL
+    return (f"https://rr{n % 9}---sn-abc.googlevideo.com/videoplayback?expire=1792225732&ei={video_id}"
+            + "&" + "x" * 900 + f"&id={n}")
+
+def build_legacy(chats, tracks, catalog):
+    queues = defaultdict(list)
+    n = 0
+    for chat_id in range(chats):
+        for _ in range(tracks):
+            video_id, title, duration = catalog[n % len(catalog)]
+            # Every /play ran its own extraction, so each URL is a distinct string
+            queues[chat_id].append(LegacySong(
+                title, duration, signed_url(video_id, n),
+                f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+                f'<a href="tg://user?id={100000 + n % 5000}">User {n % 5000}</a>',
+                "".join(["You", "Tube"])
+            ))
+            n += 1
+    return queues
+
+def build_compact(chats, tracks, catalog):
+    queues = defaultdict(deque)
+    n = 0
+    for chat_id in range(chats):
+        for _ in range(tracks):
+            video_id, title, duration = catalog[n % len(catalog)]
+            queues[chat_id].append(Song(title, duration, video_id, 100000 + n % 5000, f"User {n % 5000}", "".join(["You", "Tube"])))
+            n += 1
+    return queues
+
+def measure(build, *args):
+    gc.collect()
+    tracemalloc.start()
+    queues = build(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del queues
+    gc.collect()
+    return size
+
+def main():
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    tracks = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    rng = random.Random(0)
+    catalog = [
+        (f"{i:011d}", f"Track {i} - " + "".join(rng.choices("abcdefghij ", k=30)), rng.randint(120, 420))
+        for i in range(5000)
+    ]
+
+    legacy = measure(build_legacy, chats, tracks, catalog)
+    compact = measure(build_compact, chats, tracks, catalog)
+    songs = chats * tracks
+    print(f"{chats} chats x {tracks} tracks = {songs} queued songs")
+    print(f"legacy  (list, Song with __dict__ + URL): {legacy / 2**20:8.1f} MiB  {legacy / songs:7.0f} B/song")
+    print(f"compact (deque, slotted Song):            {compact / 2**20:8.1f} MiB  {compact / songs:7.0f} B/song")
+    print(f"saved: {(1 - compact / legacy) * 100:.0f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Cold start benchmark: time to import the bot and time until /ready answers 200.
+
+Each run is a fresh interpreter (so imports are really cold) using the fake Telegram and PyTgCalls from
+load_test.py with a fixed connect latency; yt-dlp is the real package, imported by the extractor warm-up.
+Results are printed as JSON so runs on different commits can be compared.
+
+Run from the repository root:  python benchmarks/startup.py [--runs 5] [--assistants 2] [--connect-latency 500]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def wait_ready(port, started, timeout=60):
+    """Poll /ready like a load balancer would; seconds since start when it first answers 200"""
+    import aiohttp
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1)) as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/ready") as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - started
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.01)
+    return None
+
+async def child_run(started, imported, port):
+    import main
+    from extractor import extractor
+    from health_server import health_server
+
+    task = asyncio.ensure_future(main.main())
+    ready = await wait_ready(port, started)
+    # The warm-up keeps going after /ready; report when the first /play would no longer pay for it
+    while extractor.active and time.perf_counter() - started < 60:
+        await asyncio.sleep(0.01)
+    warm = time.perf_counter() - started
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    await health_server.stop()
+    return {'import_s': imported, 'ready_s': ready, 'extractor_warm_s': warm}
+
+def child(args):
+    started = time.perf_counter()
+    port = free_port()
+    os.environ.update({
+        "STATE_BACKEND": "memory",
+        "STREAM_WORKERS": "0",
+        "SESSION_STRINGS": ",".join(f"fake{i}" for i in range(args.assistants)),
+        "PORT": str(port),
+        "ENABLE_HEALTH_CHECK": "True"
+    })
+    import load_test
+    load_test.Latency.connect = args.connect_latency / 1000
+    load_test.install_fakes(youtube_dl=False)
+    os.chdir(tempfile.mkdtemp(prefix="musicbot-startup-"))
+    import main  # noqa: F401  (timed: the bot's own import cost)
+    imported = time.perf_counter() - started
+    result = asyncio.run(child_run(started, imported, port))
+    print(json.dumps(result))
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {
+        'median': round(statistics.median(values), 3),
+        'min': round(min(values), 3),
+        'max': round(max(values), 3)
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--assistants", type=int, default=2, help="user sessions started next to the bot (0: bot streams)")
+    parser.add_argument("--connect-latency", type=float, default=500, help="ms for each client to connect")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--assistants", str(args.assistants),
+             "--connect-latency", str(args.connect_latency)],
+            capture_output=True, text=True, timeout=120
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith('{')]
+        if proc.returncode != 0 or not lines:
+            sys.exit(f"Run failed:\n{proc.stderr[-2000:]}")
+        runs.append(json.loads(lines[-1]))
+
+    print(json.dumps({
+        'commit': git_commit(),
+        'params': {'runs': args.runs, 'assistants': args.assistants, 'connect_latency_ms': args.connect_latency},
+        **{key: summarize([run[key] for run in runs]) for key in ('import_s', 'ready_s', 'extractor_warm_s')}
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from metrics import registry, labels, Counter, Gauge
+from config import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_RESULTS_TTL, STREAM_CACHE_SIZE, STREAM_CACHE_TTL
+
+# Refresh stream URLs this many seconds before YouTube's expire= deadline
+EXPIRY_MARGIN = 300
+
+_YT_ID = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_EXPIRE_PATH = re.compile(r'/expire/(\d+)')
+
+class TTLCache:
+    """Size-bounded LRU cache whose entries also expire after a TTL"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a fresh value (and mark it recently used) or None"""
+        entry = self.data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.data[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entries past maxsize"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self.data[key] = (time.monotonic() + ttl, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def peek(self, key):
+        """Return a fresh value without touching counters or LRU order"""
+        entry = self.data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def pop(self, key):
+        entry = self.data.pop(key, None)
+        return entry[1] if entry else None
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one shared task"""
+
+    def __init__(self):
+        self.inflight = {}
+        self.shared = 0
+
+    async def run(self, key, factory):
+        """Await the in-flight task for key, or start one from factory()"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.shared += 1
+        # One impatient caller must not cancel the work for everyone else
+        return await asyncio.shield(task)
+
+def video_id_from_url(url):
+    """Extract a YouTube video ID from the common URL shapes"""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+    if host.endswith('youtu.be'):
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif host.endswith('youtube.com') or host.endswith('youtube-nocookie.com'):
+        if parsed.path == '/watch':
+            candidate = parse_qs(parsed.query).get('v', [''])[0]
+        else:
+            parts = parsed.path.strip('/').split('/')
+            candidate = parts[1] if len(parts) > 1 and parts[0] in ('shorts', 'embed', 'live', 'v') else ''
+    else:
+        return None
+    return candidate if _YT_ID.match(candidate) else None
+
+def normalize_query(query):
+    """Cache key for a /play query: video ID for YouTube links, folded text otherwise"""
+    query = query.strip()
+    if query.startswith(('http://', 'https://')):
+        video_id = video_id_from_url(query)
+        return f"id:{video_id}" if video_id else f"url:{query}"
+    return "q:" + " ".join(query.casefold().split())
+
+def url_expiry(url):
+    """Unix time at which a signed googlevideo URL stops working, if it says"""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+    expire = parse_qs(parsed.query).get('expire', [None])[0]
+    if not expire:
+        match = _EXPIRE_PATH.search(parsed.path)
+        expire = match.group(1) if match else None
+    try:
+        return int(expire) if expire else None
+    except ValueError:
+        return None
+
+def stream_ttl(url):
+    """How long a resolved stream URL may be served from cache"""
+    expiry = url_expiry(url)
+    if expiry is None:
+        return STREAM_CACHE_TTL
+    return min(STREAM_CACHE_TTL, expiry - time.time() - EXPIRY_MARGIN)
+
+def url_is_fresh(url, needed=0):
+    """True if the URL stays valid for `needed` more seconds (plus the safety margin)"""
+    expiry = url_expiry(url)
+    return expiry is None or expiry - time.time() > needed + EXPIRY_MARGIN
+
+# query key -> video ID, video ID -> metadata, video ID -> direct audio URL, query key -> /search results
+query_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+metadata_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+stream_cache = TTLCache(STREAM_CACHE_SIZE, STREAM_CACHE_TTL)
+# Short-lived: ranking changes, and inline mode sends a query per keystroke
+results_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_RESULTS_TTL)
+
+def cached_video_id(query):
+    """Video ID a query resolved to last time, if still remembered"""
+    return query_cache.get(normalize_query(query))
+
+def get_cached_song(video_id):
+    """Return a complete song_info dict if metadata and a live stream URL are cached"""
+    metadata = metadata_cache.get(video_id)
+    url = stream_cache.get(video_id)
+    if not metadata or not url:
+        return None
+    return dict(metadata, url=url)
+
+def cached_page_url(video_id):
+    """Canonical page URL of a known video, to re-extract it without searching"""
+    metadata = metadata_cache.peek(video_id)
+    return metadata.get('webpage_url') if metadata else None
+
+def store_song(query, song_info):
+    """Remember an extraction result under its query and video ID"""
+    video_id = song_info.get('id')
+    if not video_id:
+        return
+    query_cache.set(normalize_query(query), video_id)
+    query_cache.set(f"id:{video_id}", video_id)
+    metadata_cache.set(video_id, {k: v for k, v in song_info.items() if k != 'url'})
+    stream_cache.set(video_id, song_info['url'], ttl=stream_ttl(song_info['url']))
+
+def _cache_requests():
+    result = {}
+    for name, cache in (('queries', query_cache), ('metadata', metadata_cache), ('streams', stream_cache),
+                        ('results', results_cache)):
+        result[labels(cache=name, result='hit')] = cache.hits
+        result[labels(cache=name, result='miss')] = cache.misses
+    return result
+
+registry.register(Counter('musicbot_cache_requests_total', 'Search/metadata/stream cache lookups', function=_cache_requests))
+registry.register(Gauge('musicbot_cache_entries', 'Entries held in each cache', function=lambda: {
+    labels(cache='queries'): len(query_cache),
+    labels(cache='metadata'): len(metadata_cache),
+    labels(cache='streams'): len(stream_cache),
+    labels(cache='results'): len(results_cache)
+}))
+
+def cache_stats():
+    return {
+        'queries': query_cache.stats(),
+        'metadata': metadata_cache.stats(),
+        'streams': stream_cache.stats(),
+        'results': results_cache.stats()
+    }
@@ -12,6 +12,14 @@ SESSION_STRING: Optional[str] = os.environ.get("SESSION_STRING", None)
 
 # Logging Configuration
 LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
+LOG_FILE: str = os.environ.get("LOG_FILE", "bot.log")  # empty logs to stderr only
+LOG_JSON: bool = os.environ.get("LOG_JSON", "False").lower() == "true"  # one JSON object per line
+LOG_MAX_BYTES: int = int(os.environ.get("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # rotate when the file grows past this
+LOG_ROTATE_WHEN: str = os.environ.get("LOG_ROTATE_WHEN", "midnight")  # and on this schedule (TimedRotatingFileHandler)
+LOG_BACKUP_COUNT: int = int(os.environ.get("LOG_BACKUP_COUNT", "7"))  # rotated files kept
+LOG_QUEUE_SIZE: int = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))  # records waiting for the writer; more are dropped
+LOG_REPEAT_LIMIT: int = int(os.environ.get("LOG_REPEAT_LIMIT", "5"))  # warnings/errors per call site per window (0 = no limit)
+LOG_REPEAT_WINDOW: float = float(os.environ.get("LOG_REPEAT_WINDOW", "60"))  # seconds
 
 # Download Configuration
 DOWNLOAD_DIR: str = "downloads"
@@ -21,7 +29,7 @@ MAX_DOWNLOAD_SIZE: int = 500  # MB
 MAX_QUEUE_SIZE: int = 50
 
 # Timeout Configuration
-DOWNLOAD_TIMEOUT: int = 300  # seconds
+DOWNLOAD_TIMEOUT: int = int(os.environ.get("DOWNLOAD_TIMEOUT", "300"))  # seconds
 
 # Feature Flags
 ENABLE_SPOTIFY: bool = os.environ.get("ENABLE_SPOTIFY", "True").lower() == "true"
@@ -32,4 +40,88 @@ SUDO_USERS: list = [int(x) for x in os.environ.get("SUDO_USERS", "").split(",")
 
 # Health Check Configuration (for Render/Railway)
 HEALTH_CHECK_PORT: int = int(os.environ.get("PORT", "8000"))
-ENABLE_HEALTH_CHECK: bool = os.environ.get("ENABLE_HEALTH_CHECK", "True").lower() == "true"
+ENABLE_HEALTH_CHECK: bool = os.environ.get("ENABLE_HEALTH_CHECK", "True").lower() == "true"
+
+# Extraction Configuration
+EXTRACTOR_MODE: str = os.environ.get("EXTRACTOR_MODE", "thread").lower()  # "thread" or "process"
+EXTRACTOR_WORKERS: int = int(os.environ.get("EXTRACTOR_WORKERS", "4"))
+
+# Cache Configuration
+SEARCH_CACHE_SIZE: int = int(os.environ.get("SEARCH_CACHE_SIZE", "5000"))  # entries
+SEARCH_CACHE_TTL: int = int(os.environ.get("SEARCH_CACHE_TTL", "86400"))  # seconds
+STREAM_CACHE_SIZE: int = int(os.environ.get("STREAM_CACHE_SIZE", "2000"))  # entries
+STREAM_CACHE_TTL: int = int(os.environ.get("STREAM_CACHE_TTL", "18000"))  # seconds, capped by the URL's own expire=
+SEARCH_RESULTS_TTL: int = int(os.environ.get("SEARCH_RESULTS_TTL", "300"))  # seconds, /search and inline result lists
+
+# Search Configuration (/search and inline mode list results; streams are resolved for the picked one only)
+SEARCH_RESULTS: int = int(os.environ.get("SEARCH_RESULTS", "5"))  # results per search
+INLINE_MIN_QUERY: int = int(os.environ.get("INLINE_MIN_QUERY", "3"))  # characters before inline mode searches
+
+# Prefetch Configuration
+PREFETCH_LEAD: int = int(os.environ.get("PREFETCH_LEAD", "30"))  # seconds before track end
+PREFETCH_WARMUP: bool = os.environ.get("PREFETCH_WARMUP", "False").lower() == "true"
+
+# State Persistence Configuration
+STATE_BACKEND: str = os.environ.get("STATE_BACKEND", "sqlite").lower()  # "sqlite" or "memory"
+STATE_DB_PATH: str = os.environ.get("STATE_DB_PATH", "bot_state.db")
+STATE_FLUSH_INTERVAL: float = float(os.environ.get("STATE_FLUSH_INTERVAL", "2"))  # seconds
+RESTORE_CONCURRENCY: int = int(os.environ.get("RESTORE_CONCURRENCY", "10"))
+RESTORE_TIMEOUT: int = int(os.environ.get("RESTORE_TIMEOUT", "30"))  # seconds per chat
+
+# Admin Cache Configuration
+ADMIN_CACHE_TTL: int = int(os.environ.get("ADMIN_CACHE_TTL", "300"))  # seconds
+ADMIN_CACHE_SIZE: int = int(os.environ.get("ADMIN_CACHE_SIZE", "10000"))  # chats
+
+# Profiler Configuration (opt-in, cheap enough to leave on in production)
+ENABLE_PROFILER: bool = os.environ.get("ENABLE_PROFILER", "False").lower() == "true"
+SLOW_HANDLER_THRESHOLD: float = float(os.environ.get("SLOW_HANDLER_THRESHOLD", "5"))  # seconds, wall time
+LOOP_BLOCK_THRESHOLD: float = float(os.environ.get("LOOP_BLOCK_THRESHOLD", "0.2"))  # seconds without yielding
+
+# Local Audio Cache Configuration (stored in DOWNLOAD_DIR, bounded by MAX_DOWNLOAD_SIZE)
+ENABLE_AUDIO_CACHE: bool = os.environ.get("ENABLE_AUDIO_CACHE", "False").lower() == "true"
+AUDIO_CACHE_MIN_PLAYS: int = int(os.environ.get("AUDIO_CACHE_MIN_PLAYS", "3"))  # plays before a track is cached
+AUDIO_CACHE_MAX_DURATION: int = int(os.environ.get("AUDIO_CACHE_MAX_DURATION", "900"))  # seconds
+
+# Assistant Configuration (comma separated session strings; SESSION_STRING is used if unset)
+SESSION_STRINGS: list = [x.strip() for x in os.environ.get("SESSION_STRINGS", SESSION_STRING or "").split(",") if x.strip()]
+MAX_CALLS_PER_ASSISTANT: int = int(os.environ.get("MAX_CALLS_PER_ASSISTANT", "100"))
+
+# Streaming Worker Configuration (0 streams in the bot process; N splits SESSION_STRINGS over N processes)
+STREAM_WORKERS: int = int(os.environ.get("STREAM_WORKERS", "0"))
+WORKER_CALL_TIMEOUT: int = int(os.environ.get("WORKER_CALL_TIMEOUT", "60"))  # seconds per play/pause/leave job
+WORKER_RESTART_DELAY: int = int(os.environ.get("WORKER_RESTART_DELAY", "5"))  # seconds
+
+# Outgoing Message Limits (Telegram allows ~30 messages/s per bot and ~20/min per group)
+OUTBOX_GLOBAL_RATE: float = float(os.environ.get("OUTBOX_GLOBAL_RATE", "25"))  # messages per second
+OUTBOX_CHAT_RATE: float = float(os.environ.get("OUTBOX_CHAT_RATE", "0.33"))  # messages per second per chat
+OUTBOX_CHAT_BURST: int = int(os.environ.get("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_MAX_FLOOD_WAIT: int = int(os.environ.get("OUTBOX_MAX_FLOOD_WAIT", "60"))  # longer FloodWaits drop the message
+
+# Command Throttling (applies to commands that start an extraction; sudo users are exempt)
+USER_COMMAND_RATE: float = float(os.environ.get("USER_COMMAND_RATE", "0.2"))  # per second, per user
+USER_COMMAND_BURST: int = int(os.environ.get("USER_COMMAND_BURST", "3"))
+CHAT_COMMAND_RATE: float = float(os.environ.get("CHAT_COMMAND_RATE", "0.5"))  # per second, per chat
+CHAT_COMMAND_BURST: int = int(os.environ.get("CHAT_COMMAND_BURST", "10"))
+MAX_EXTRACTION_BACKLOG: int = int(os.environ.get("MAX_EXTRACTION_BACKLOG", "50"))  # waiting extractions before shedding load
+
+# Playlist Configuration (tracks are still capped by MAX_QUEUE_SIZE)
+PLAYLIST_BATCH_SIZE: int = int(os.environ.get("PLAYLIST_BATCH_SIZE", "50"))  # entries listed per extraction
+PLAYLIST_FIRST_BATCH: int = int(os.environ.get("PLAYLIST_FIRST_BATCH", "5"))  # entries listed before playback starts
+
+# Stream Supervisor Configuration
+STALL_CHECK_INTERVAL: int = int(os.environ.get("STALL_CHECK_INTERVAL", "10"))  # seconds between played_time checks
+STALL_TIMEOUT: int = int(os.environ.get("STALL_TIMEOUT", "25"))  # seconds without progress before a stream counts as stalled
+STREAM_MAX_RETRIES: int = int(os.environ.get("STREAM_MAX_RETRIES", "3"))  # recovery attempts before skipping the song
+STREAM_RETRY_BACKOFF: float = float(os.environ.get("STREAM_RETRY_BACKOFF", "2"))  # seconds, doubled per attempt
+
+# Adaptive Audio Quality (new streams step down a tier under load, and back up once it eases)
+QUALITY_SAMPLE_INTERVAL: int = int(os.environ.get("QUALITY_SAMPLE_INTERVAL", "5"))  # seconds
+QUALITY_CPU_MEDIUM: float = float(os.environ.get("QUALITY_CPU_MEDIUM", "70"))  # host CPU % for medium quality
+QUALITY_CPU_LOW: float = float(os.environ.get("QUALITY_CPU_LOW", "85"))  # host CPU % for low quality
+QUALITY_CALLS_MEDIUM: int = int(os.environ.get("QUALITY_CALLS_MEDIUM", "50"))  # active calls for medium quality
+QUALITY_CALLS_LOW: int = int(os.environ.get("QUALITY_CALLS_LOW", "150"))  # active calls for low quality
+QUALITY_HOLD: int = int(os.environ.get("QUALITY_HOLD", "60"))  # seconds of lower load before stepping back up
+
+# Usage Statistics (constant memory: approximate distinct counts, rolling 1h/24h/7d windows)
+STATS_HLL_PRECISION: int = int(os.environ.get("STATS_HLL_PRECISION", "14"))  # 2^N registers (16 KB each), ~0.8% error at 14
+STATS_SAMPLE_INTERVAL: int = int(os.environ.get("STATS_SAMPLE_INTERVAL", "60"))  # seconds between active call samples and saves
@@ -0,0 +1,316 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from metrics import registry, Gauge
+from config import EXTRACTOR_MODE, EXTRACTOR_WORKERS, DOWNLOAD_TIMEOUT, DOWNLOAD_DIR, MAX_EXTRACTION_BACKLOG
+
+logger = logging.getLogger(__name__)
+
+# YT-DLP options (built once; each worker thread reuses its own YoutubeDL)
+YDL_OPTS = {
+    'format': 'bestaudio/best',
+    'outtmpl': 'downloads/%(id)s.%(ext)s',
+    'quiet': True,
+    'no_warnings': True,
+    'extract_flat': True,
+    'noplaylist': True, # Prevents long delays from accidentally extracting playlists
+    'nocheckcertificate': True,
+    'geo_bypass': True,
+    'ignoreerrors': True,
+    'no_check_certificate': True,
+    'prefer_ffmpeg': True,
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android', 'web'],
+            'skip': ['hls', 'dash']
+        }
+    },
+    'http_headers': {
+        # Use a robust User-Agent to help get stable direct stream URLs
+        'User-Agent': 'com.google.android.youtube/17.36.4 (Linux; U; Android 12; US) gzip',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+        'Accept-Language': 'en-us,en;q=0.5',
+    }
+}
+
+# Option overrides for the different kinds of extraction, keyed by profile name
+YDL_PROFILES = {
+    # extract_flat would leave search results unresolved (watch page URL, no audio URL)
+    'stream': {'extract_flat': False},
+    # Recovery after a failed stream: another player client and container, HLS allowed
+    'fallback': {
+        'extract_flat': False,
+        'format': 'bestaudio[ext=m4a]/bestaudio/best',
+        'extractor_args': {'youtube': {'player_client': ['ios', 'web']}},
+    },
+    # Playlists: list the entries only, each track's stream is resolved when it is about to play
+    'playlist': {'extract_flat': 'in_playlist', 'noplaylist': False},
+    # /search and inline results: metadata of the top hits, streams resolved only for the one picked
+    'search': {'extract_flat': 'in_playlist'},
+    # Local audio cache: keep the original audio stream, no transcoding
+    'download': {
+        'extract_flat': False,
+        'format': 'bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio',
+        'outtmpl': f'{DOWNLOAD_DIR}/%(id)s.%(ext)s',
+        'ignoreerrors': False,
+    },
+}
+
+COOKIE_FILE = 'cookies.txt'
+COOKIE_CHECK_INTERVAL = 30  # seconds between mtime checks of COOKIE_FILE
+
+_cookie_lock = threading.Lock()
+_cookie_jar = None
+_cookie_mtime = None
+_cookie_checked = None
+_local = threading.local()
+
+def get_cookie_jar():
+    """Shared cookie jar, parsed once and re-parsed only when the file's mtime changes"""
+    global _cookie_jar, _cookie_mtime, _cookie_checked
+    now = time.monotonic()
+    with _cookie_lock:
+        if _cookie_checked is not None and now - _cookie_checked < COOKIE_CHECK_INTERVAL:
+            return _cookie_jar, _cookie_mtime
+        _cookie_checked = now
+        try:
+            mtime = os.stat(COOKIE_FILE).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != _cookie_mtime:
+            if mtime is None:
+                _cookie_jar = None
+                logger.info(f"{COOKIE_FILE} removed, extracting without cookies")
+            else:
+                from yt_dlp.cookies import YoutubeDLCookieJar
+                jar = YoutubeDLCookieJar(COOKIE_FILE)
+                jar.load()
+                _cookie_jar = jar
+                logger.info(f"Loaded {len(jar)} cookies from {COOKIE_FILE}")
+            _cookie_mtime = mtime
+        return _cookie_jar, _cookie_mtime
+
+def get_ydl(profile='stream'):
+    """Long-lived YoutubeDL for the calling worker thread, rebuilt when the cookies change"""
+    import yt_dlp
+
+    jar, mtime = get_cookie_jar()
+    instances = getattr(_local, 'instances', None)
+    if instances is None:
+        instances = _local.instances = {}
+
+    cached = instances.get(profile)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    if cached:
+        cached[1].close()
+
+    # No 'cookiefile' option: the shared jar is injected instead, so close()
+    # never writes the file back (which would bump its mtime and force a reload)
+    ydl = yt_dlp.YoutubeDL({**YDL_OPTS, **YDL_PROFILES[profile]})
+    if jar is not None:
+        ydl.__dict__['cookiejar'] = jar
+    instances[profile] = (mtime, ydl)
+    return ydl
+
+def extract_info(query, profile='stream'):
+    """Blocking yt-dlp extraction, runs inside a worker thread/process"""
+    if not query.startswith(('http', 'https')):
+        query = f"ytsearch1:{query}"
+
+    info = get_ydl(profile).extract_info(query, download=False)
+
+    if not info:
+        logger.warning("YT-DLP extracted no information.")
+        return None
+
+    if 'entries' in info:
+        # With ignoreerrors, entries that failed to extract come back as None
+        entries = [entry for entry in info['entries'] if entry]
+        if not entries:
+            logger.warning("YT-DLP search returned no entries.")
+            return None
+        info = entries[0]
+
+    audio_url = info.get('url')
+
+    if not audio_url:
+        logger.error("No audio URL found in extracted info.")
+        return None
+
+    # Only ship the fields we need back across the worker boundary
+    return {
+        'id': info.get('id'),
+        'title': info.get('title', 'Unknown'),
+        'duration': info.get('duration', 0),
+        'url': audio_url,
+        'thumbnail': info.get('thumbnail', ''),
+        'webpage_url': info.get('webpage_url')
+    }
+
+def extract_playlist(url, start, end):
+    """Blocking flat extraction of playlist items start..end (1-based, inclusive)"""
+    ydl = get_ydl('playlist')
+    # Only the requested slice is fetched, so the first track never waits for the whole list
+    ydl.params['playlist_items'] = f"{start}:{end}"
+    info = ydl.extract_info(url, download=False)
+    if not info:
+        return None
+    return {
+        'title': info.get('title') or 'Playlist',
+        'entries': _flat_entries(info),
+        # Items in the slice before unavailable ones are dropped, and the playlist's size if the site reports it
+        'listed': len(info.get('entries') or ()),
+        'count': info.get('playlist_count')
+    }
+
+def search_entries(query, limit):
+    """Blocking flat YouTube search: metadata of the top `limit` results, no stream URLs"""
+    info = get_ydl('search').extract_info(f"ytsearch{limit}:{query}", download=False)
+    return _flat_entries(info) if info else []
+
+def _flat_entries(info):
+    entries = []
+    for entry in info.get('entries') or ():
+        # Deleted/private videos come back as None or without a URL
+        if not entry or not (entry.get('url') or entry.get('webpage_url')):
+            continue
+        entries.append({
+            'id': entry.get('id'),
+            'title': entry.get('title') or 'Unknown',
+            'duration': entry.get('duration') or 0,
+            'page_url': entry.get('webpage_url') or entry.get('url'),
+            'platform': 'YouTube' if entry.get('ie_key') in (None, 'Youtube') else entry['ie_key'],
+            'uploader': entry.get('uploader') or entry.get('channel')
+        })
+    return entries
+
+def download_audio(page_url, max_bytes):
+    """Blocking download of a track's audio into DOWNLOAD_DIR, returns the file path"""
+    ydl = get_ydl('download')
+    ydl.params['max_filesize'] = max_bytes
+    info = ydl.extract_info(page_url, download=True)
+    if not info:
+        return None
+    downloads = info.get('requested_downloads') or [{}]
+    path = downloads[0].get('filepath') or ydl.prepare_filename(info)
+    return path if os.path.exists(path) else None
+
+def prepare_worker():
+    """Blocking: import yt-dlp and build this worker's YoutubeDL ahead of the first request"""
+    get_ydl('stream')
+
+def _init_process():
+    # A forked worker inherits the parent's queue log handler but not the thread that writes it out
+    from logs import setup_logging
+    setup_logging(filename=None, tag=f"extractor{os.getpid()}")
+
+class Extractor:
+    """Bounded worker pool that keeps blocking yt-dlp calls off the event loop"""
+
+    def __init__(self, mode=EXTRACTOR_MODE, workers=EXTRACTOR_WORKERS, timeout=DOWNLOAD_TIMEOUT,
+                 max_waiting=MAX_EXTRACTION_BACKLOG):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_waiting = max_waiting
+        self.executor = None
+        self.slots = None
+        self.active = 0
+        self.waiting = 0
+
+    @property
+    def overloaded(self):
+        """Too many extractions queued for a slot: new ones would likely time out anyway"""
+        return self.waiting >= self.max_waiting
+
+    def start(self):
+        """Create the worker pool (call before the clients start so process workers fork early)"""
+        if self.executor:
+            return
+        if self.mode == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_init_process)
+            # Spawn the worker processes now rather than on the first /play
+            self.executor.submit(os.getpid)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="extractor"
+            )
+        logger.info(f"Extractor pool started ({self.mode}, {self.workers} workers, {self.timeout}s timeout)")
+
+    async def run(self, func, *args, timeout=None):
+        """Run a blocking function in the pool with the concurrency limit and a timeout"""
+        if not self.executor:
+            self.start()
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.workers)
+        loop = asyncio.get_running_loop()
+
+        # Waiting for a slot is cancellable and counts towards the timeout
+        deadline = loop.time() + (timeout or self.timeout)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), deadline - loop.time())
+        finally:
+            self.waiting -= 1
+
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+
+        self.active += 1
+
+        def release(_):
+            # A timed-out thread keeps running; its slot is only freed once it really finishes
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                pass
+
+        future.add_done_callback(release)
+        # Cancelling the wrapper also cancels the pool future if it has not started yet
+        return await asyncio.wait_for(asyncio.wrap_future(future), max(0, deadline - loop.time()))
+
+    def _release(self):
+        self.active -= 1
+        self.slots.release()
+
+    async def warm_up(self):
+        """Prepare every worker in the background; a failure only makes the first requests slower"""
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.run(prepare_worker) for _ in range(self.workers)), return_exceptions=True)
+        failed = [r for r in results if isinstance(r, BaseException)]
+        if failed:
+            logger.warning(f"Extractor warm-up failed in {len(failed)}/{self.workers} workers: {failed[0]}")
+        logger.info(f"Extractor warmed up in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    async def extract(self, query, timeout=None, profile='stream'):
+        """Extract audio info for a search query or URL"""
+        return await self.run(extract_info, query, profile, timeout=timeout)
+
+    async def playlist(self, url, start, end, timeout=None):
+        """List playlist items start..end without resolving their streams"""
+        return await self.run(extract_playlist, url, start, end, timeout=timeout)
+
+    async def search(self, query, limit, timeout=None):
+        """Top search results (flat metadata) for a query"""
+        return await self.run(search_entries, query, limit, timeout=timeout)
+
+    def shutdown(self):
+        """Stop the pool, dropping extractions that have not started yet"""
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            logger.info("Extractor pool stopped")
+
+# Global instance
+extractor = Extractor()
+
+registry.register(Gauge('musicbot_extractions_active', 'Extractions running in the pool', function=lambda: extractor.active))
+registry.register(Gauge('musicbot_extractions_waiting', 'Extractions waiting for a free pool slot', function=lambda: extractor.waiting))
@@ -3,6 +3,9 @@ import asyncio
 import logging
 from datetime import datetime
 from config import HEALTH_CHECK_PORT, ENABLE_HEALTH_CHECK
+from metrics import registry
+from profiler import profiler
+from stats import usage
 
 logger = logging.getLogger(__name__)
 
@@ -12,27 +15,69 @@ class HealthCheckServer:
         self.runner = None
         self.site = None
         self.start_time = datetime.now()
+        # Set once startup finishes: returns {component: ok}; None means still starting
+        self.readiness = None
+        # Set by main: the streaming backend's per-assistant (or per-worker) status
+        self.streaming = None
         self.setup_routes()
     
     def setup_routes(self):
         """Setup health check routes"""
         self.app.router.add_get('/health', self.health_check)
+        self.app.router.add_get('/ready', self.ready_check)
         self.app.router.add_get('/ping', self.ping)
+        self.app.router.add_get('/metrics', self.metrics)
+        self.app.router.add_get('/stats', self.stats)
+        self.app.router.add_get('/streaming', self.streaming_status)
+        self.app.router.add_get('/debug/slow', self.slow_handlers)
         self.app.router.add_get('/', self.root)
     
     async def health_check(self, request):
-        """Health check endpoint for hosting platforms"""
+        """Liveness endpoint for hosting platforms: the process and its event loop are up"""
         uptime = datetime.now() - self.start_time
         return web.json_response({
             'status': 'healthy',
+            'ready': self.is_ready(),
             'uptime': str(uptime).split('.')[0],
             'timestamp': datetime.now().isoformat()
         })
     
+    def is_ready(self):
+        return self.readiness is not None and all(self.readiness().values())
+    
+    async def ready_check(self, request):
+        """Readiness endpoint: 200 once the bot can serve commands, 503 while starting or disconnected"""
+        if self.readiness is None:
+            return web.json_response({'status': 'starting'}, status=503)
+        checks = self.readiness()
+        ready = all(checks.values())
+        return web.json_response({
+            'status': 'ready' if ready else 'unavailable',
+            'checks': checks
+        }, status=200 if ready else 503)
+    
     async def ping(self, request):
         """Simple ping endpoint"""
         return web.Response(text='pong')
     
+    async def metrics(self, request):
+        """Prometheus metrics endpoint"""
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+    
+    async def stats(self, request):
+        """Distinct users/chats and 1h/24h/7d activity windows"""
+        return web.json_response(usage.summary())
+    
+    async def streaming_status(self, request):
+        """Calls per assistant and whether it takes new chats, or the streaming workers' state"""
+        if self.streaming is None:
+            return web.json_response({'status': 'starting'}, status=503)
+        return web.json_response(self.streaming())
+    
+    async def slow_handlers(self, request):
+        """Worst handlers and recent event-loop stalls (needs ENABLE_PROFILER)"""
+        return web.json_response(profiler.report())
+    
     async def root(self, request):
         """Root endpoint"""
         uptime = datetime.now() - self.start_time
@@ -0,0 +1,170 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from metrics import registry, Counter
+from config import (LOG_LEVEL, LOG_FILE, LOG_JSON, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT, LOG_QUEUE_SIZE,
+                    LOG_REPEAT_LIMIT, LOG_REPEAT_WINDOW)
+
+# Logging pipeline: callers only format the record and put it on a bounded queue; a listener thread does the
+# file/console I/O, so a slow disk never shows up as event loop lag.
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Optional fields passed with extra={...}; written as top-level keys in JSON output
+STRUCTURED_FIELDS = ('chat_id', 'user_id', 'latency_ms', 'op')
+
+# Chat the current task works for (set by the chat actors); tags records that did not pass chat_id themselves
+log_chat = ContextVar('log_chat', default=None)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def __init__(self, tag=None):
+        super().__init__()
+        self.tag = tag
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        if self.tag:
+            entry['process'] = self.tag
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RepeatFilter(logging.Filter):
+    """Rate-limits warnings and errors per call site: `limit` per `window` seconds, the rest are counted
+
+    Only the first record of a window keeps its traceback; the next one that gets through reports how many
+    were suppressed in between."""
+
+    def __init__(self, limit=LOG_REPEAT_LIMIT, window=LOG_REPEAT_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # (pathname, lineno) -> [window start, records let through, records suppressed]
+        self.sites = {}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        if site is None or now - site[0] >= self.window:
+            suppressed = site[2] if site else 0
+            if len(self.sites) > 10000:
+                self.sites.clear()
+            site = self.sites[key] = [now, 0, 0]
+        else:
+            suppressed = 0
+        if site[1] >= self.limit:
+            site[2] += 1
+            return False
+        if site[1] > 0 and record.exc_info:
+            # Same place, same failure: one traceback per window is enough
+            record.exc_info = None
+            record.exc_text = None
+        site[1] += 1
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar suppressed)"
+            record.args = None
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking or raising"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the message and render the traceback here; the listener thread never sees live objects
+        record = copy.copy(record)
+        if getattr(record, 'chat_id', None) is None:
+            record.chat_id = log_chat.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class RotatingFileHandler(TimedRotatingFileHandler):
+    """Rotates at `when` and whenever the file grows past max_bytes"""
+
+    def __init__(self, filename, max_bytes, when, backup_count):
+        super().__init__(filename, when=when, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        # Several size rotations in one interval would otherwise overwrite each other's file
+        self.namer = _unused_name
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if self.max_bytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream.tell() >= self.max_bytes
+
+def _unused_name(name):
+    candidate, n = name, 0
+    while os.path.exists(candidate):
+        n += 1
+        # Zero-padded so the oldest sorts first when old files are deleted
+        candidate = f"{name}.{n:03d}"
+    return candidate
+
+def setup_logging(filename=LOG_FILE, level=LOG_LEVEL, json_output=LOG_JSON, tag=None):
+    """Route all logging through a background listener thread; returns the listener
+
+    filename: rotated log file (None or empty logs to stderr only); tag: prefix for text output, e.g. a worker name"""
+    formatter = JsonFormatter(tag) if json_output else logging.Formatter(
+        TEXT_FORMAT.replace('%(name)s', f'{tag} - %(name)s') if tag else TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if filename:
+        handlers.append(RotatingFileHandler(filename, LOG_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RepeatFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    registry.register(Counter('musicbot_log_records_dropped_total', 'Log records dropped because the writer fell behind',
+                              function=lambda: queue_handler.dropped))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush what is still queued on exit
+    atexit.register(listener.stop)
+    return listener
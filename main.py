@@ -1,34 +1,43 @@
 import asyncio
 import os
+import random
 import logging
 import sys
+import time
 from pyrogram import Client, filters
-from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from pytgcalls import PyTgCalls
-from pytgcalls.types.input_stream import AudioPiped
-from pytgcalls.types.input_stream.quality import HighQualityAudio
-from pytgcalls.exceptions import NoActiveGroupCall, AlreadyJoinedError, NotInGroupCallError, NotInGroupCallError
-import yt_dlp
+from pyrogram.types import (Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ChatMemberUpdated, InlineQuery,
+                            InlineQueryResultArticle, InputTextMessageContent)
+from pytgcalls.exceptions import NoActiveGroupCall, NotInGroupCallError
 import aiohttp
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
 from datetime import datetime
-import psutil
-from config import API_ID, API_HASH, BOT_TOKEN, BOT_NAME, SUDO_USERS
+from config import API_ID, API_HASH, BOT_TOKEN, BOT_NAME, SUDO_USERS, DOWNLOAD_DIR, MAX_QUEUE_SIZE, PLAYLIST_BATCH_SIZE, PLAYLIST_FIRST_BATCH, PREFETCH_WARMUP, RESTORE_CONCURRENCY, RESTORE_TIMEOUT, SEARCH_RESULTS, SEARCH_RESULTS_TTL, INLINE_MIN_QUERY
 from health_server import health_server 
+from extractor import extractor
+from cache import TTLCache, SingleFlight, get_cached_song, cached_page_url, cached_video_id, normalize_query, store_song, stream_cache, results_cache, url_is_fresh
+from prefetch import prefetcher
+from storage import state_store
+from song import Song
+from admin_cache import admin_cache, ADMIN_STATUSES
+from audio_cache import audio_cache
+from streaming import create_backend
+from outbox import outbox
+from supervisor import supervisor
+from players import players, StaleEvent
+from quality import quality, CHAT_SETTINGS
+from ratelimit import command_throttle, THROTTLED
+from stats import usage
+from profiler import profiler
+from logs import setup_logging
+from metrics import registry, Gauge, EXTRACTION_SECONDS, EXTRACTION_FAILURES, PLAY_LATENCY_SECONDS, monitor_loop_lag
 # NOTE: Ensure 'config.py' and 'health_server.py' are present in your environment.
 # 🚨 CRITICAL: Ensure FFmpeg is installed and accessible on your server for streaming!
 
 # --- Configuration and Initialization ---
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging (file and console writes happen on a background thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize clients
@@ -39,63 +48,66 @@ app = Client(
     bot_token=BOT_TOKEN
 )
 
-# Initialize PyTgCalls AFTER app
-pytgcalls = PyTgCalls(app)
+# Voice chats: assistants in this process, or STREAM_WORKERS worker processes that own a share of the chats
+backend = create_backend(app)
 
 # Global state
-queues = defaultdict(list)
+queues = defaultdict(deque)
 current_playing = {}
 start_time = datetime.now()
-bot_stats = {'chats': set(), 'users': set(), 'played': 0}
 auth_users = defaultdict(set)
 maintenance_mode = False
 blocked_users = set()
 blocked_chats = set()
 gbanned_users = set()
+extractions = SingleFlight()
+playlist_loads = {}
+# Bumped on every change to a chat's queue or current song; /queue pages are cached per version
+queue_versions = {}
+queue_pages = TTLCache(5000, 600)
+QUEUE_PAGE_SIZE = 10
+MAX_PLAYMANY = 10
+
+registry.register(Gauge('musicbot_active_calls', 'Voice chats currently playing', function=lambda: len(current_playing)))
+registry.register(Gauge('musicbot_queued_songs', 'Songs waiting in all chat queues', function=lambda: sum(map(len, queues.values()))))
+registry.register(Gauge('musicbot_queue_depth_max', 'Longest chat queue', function=lambda: max(map(len, queues.values()), default=0)))
+STARTUP_SECONDS = registry.register(Gauge('musicbot_startup_seconds', 'Time from main() starting to serving commands'))
 
-# YT-DLP options
-def get_ydl_opts():
-    """Get YT-DLP options with optional cookies and stability features"""
-    opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': 'downloads/%(id)s.%(ext)s',
-        'quiet': True,
-        'no_warnings': True,
-        'extract_flat': True,
-        'noplaylist': True, # Prevents long delays from accidentally extracting playlists
-        'nocheckcertificate': True,
-        'geo_bypass': True,
-        'ignoreerrors': True,
-        'no_check_certificate': True,
-        'prefer_ffmpeg': True,
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['android', 'web'],
-                'skip': ['hls', 'dash']
-            }
-        },
-        'http_headers': {
-            # Use a robust User-Agent to help get stable direct stream URLs
-            'User-Agent': 'com.google.android.youtube/17.36.4 (Linux; U; Android 12; US) gzip',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Accept-Language': 'en-us,en;q=0.5',
-        }
+def queue_changed(chat_id):
+    """Invalidate the chat's rendered /queue pages and schedule it for persistence"""
+    queue_versions[chat_id] = queue_versions.get(chat_id, 0) + 1
+    state_store.mark_chat(chat_id)
+
+def serialize_chat(chat_id):
+    """Snapshot a chat's playback state for the state store (None deletes it)"""
+    current = current_playing.get(chat_id)
+    queue = queues.get(chat_id)
+    if not current and not queue:
+        return None
+    return {
+        'current': current.to_dict() if current else None,
+        'queue': [song.to_dict() for song in queue or ()]
     }
-    
-    if os.path.exists('cookies.txt'):
-        opts['cookiefile'] = 'cookies.txt'
-        logger.info("Using cookies.txt")
-    
-    return opts
 
-class Song:
-    def __init__(self, title, duration, url, thumbnail, requester, platform="YouTube"):
-        self.title = title
-        self.duration = duration
-        self.url = url
-        self.thumbnail = thumbnail
-        self.requester = requester
-        self.platform = platform
+def track_usage(user_id, chat_id=None):
+    """Count a user (and group chat) in the stats; persisted with the periodic stats sample"""
+    usage.seen(user_id, chat_id)
+
+state_store.bind(
+    serialize_chat,
+    sets={
+        'auth': auth_users,
+        'blocked_users': blocked_users,
+        'blocked_chats': blocked_chats,
+        'gbanned_users': gbanned_users
+    },
+    values={
+        'played': lambda: usage.played,
+        'usage': usage.dump,
+        'maintenance_mode': lambda: maintenance_mode,
+        'chat_quality': lambda: quality.chat_settings
+    }
+)
 
 def is_sudo(user_id):
     """Check if user is sudo"""
@@ -107,14 +119,27 @@ async def is_admin(chat_id, user_id):
         return True
     if user_id in auth_users[chat_id]:
         return True
-    try:
-        member = await app.get_chat_member(chat_id, user_id)
-        return member.status in ["creator", "administrator"]
-    except:
-        return False
+    # Served from the per-chat admin cache; FloodWaits are logged there, not swallowed
+    return user_id in await admin_cache.get(app, chat_id)
 
 async def download_song(query):
     """Download and extract audio info with error handling"""
+    video_id = cached_video_id(query)
+    if video_id:
+        song_info = get_cached_song(video_id)
+        if song_info:
+            logger.info(f"Cache hit: {song_info['title']}")
+            return song_info
+    
+    # Identical concurrent /play requests share a single extraction
+    key = f"id:{video_id}" if video_id else normalize_query(query)
+    return await extractions.run(key, lambda: extract_song(query, video_id))
+
+async def extract_song(query, video_id=None):
+    """Run the extraction with retries and cache the result"""
+    # Known video with an expired stream URL: skip the search round trip
+    source = (cached_page_url(video_id) if video_id else None) or query
+    
     max_retries = 2
     
     for attempt in range(max_retries):
@@ -123,51 +148,141 @@ async def download_song(query):
                 logger.info(f"Retry attempt {attempt + 1}/{max_retries} for query: {query}")
                 await asyncio.sleep(2)
             
-            ydl_opts = get_ydl_opts()
+            logger.info(f"Extracting info for: {source}")
+            started = time.perf_counter()
+            # Runs in the extractor pool so a slow search never blocks the event loop
+            with EXTRACTION_SECONDS.time():
+                song_info = await extractor.extract(source)
             
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                if not query.startswith(('http', 'https')):
-                    query = f"ytsearch1:{query}"
-                
-                logger.info(f"Extracting info for: {query}")
-                info = ydl.extract_info(query, download=False)
-                
-                if not info:
-                    logger.warning("YT-DLP extracted no information.")
-                    continue
-                
-                if 'entries' in info:
-                    if not info['entries']:
-                        logger.warning("YT-DLP search returned no entries.")
-                        continue
-                    info = info['entries'][0]
-                
-                audio_url = info.get('url')
-                
-                if not audio_url:
-                    logger.error("No audio URL found in extracted info.")
-                    continue
-                
-                title = info.get('title', 'Unknown')
-                duration = info.get('duration', 0)
-                thumbnail = info.get('thumbnail', '')
-                
-                logger.info(f"Extracted: {title}")
-                
-                return {
-                    'title': title,
-                    'duration': duration,
-                    'url': audio_url,
-                    'thumbnail': thumbnail
-                }
+            if not song_info:
+                EXTRACTION_FAILURES.inc(reason='empty')
+                usage.record('extraction_failures')
+                continue
+            
+            logger.info(f"Extracted: {song_info['title']}",
+                        extra={'latency_ms': round((time.perf_counter() - started) * 1000)})
+            store_song(query, song_info)
+            return song_info
                 
+        except asyncio.TimeoutError:
+            # Already waited the full DOWNLOAD_TIMEOUT, retrying would only double it
+            EXTRACTION_FAILURES.inc(reason='timeout')
+            usage.record('extraction_failures')
+            logger.error(f"Extraction timed out for {query} (Attempt {attempt + 1})")
+            return None
         except Exception as e:
-            logger.error(f"Download/Extraction error for {query} (Attempt {attempt + 1}): {e}", exc_info=True)
+            EXTRACTION_FAILURES.inc(reason='error')
+            usage.record('extraction_failures')
+            # Only the final attempt's traceback is worth keeping
+            logger.error(f"Download/Extraction error for {query} (Attempt {attempt + 1}): {e}",
+                         exc_info=attempt == max_retries - 1)
             if attempt == max_retries - 1:
                 return None
     
     return None
 
+async def search_results(query):
+    """Top SEARCH_RESULTS hits for a query as flat entries (no stream URLs), cached for SEARCH_RESULTS_TTL"""
+    key = normalize_query(query)
+    results = results_cache.get(key)
+    if results is not None:
+        return results
+    try:
+        # Inline mode asks again on every keystroke; users typing the same thing share one search
+        results = await extractions.run(f"search:{key}", lambda: extractor.search(query, SEARCH_RESULTS))
+    except asyncio.TimeoutError:
+        EXTRACTION_FAILURES.inc(reason='timeout')
+        logger.error(f"Search timed out for {query}")
+        return []
+    except Exception as e:
+        EXTRACTION_FAILURES.inc(reason='error')
+        logger.error(f"Search error for {query}: {e}")
+        return []
+    if results:
+        results_cache.set(key, results)
+    return results or []
+
+async def resolve_stream_url(song, force=False):
+    """Get a stream URL for a song that stays valid until the song finishes"""
+    if song.video_id:
+        url = stream_cache.get(song.video_id)
+        if url and not force and url_is_fresh(url, song.duration or 0):
+            return url
+        stream_cache.pop(song.video_id)
+    logger.info(f"Resolving stream URL for {song.title}")
+    song_info = await download_song(song.page_url)
+    return song_info['url'] if song_info else None
+
+async def warm_up_url(url):
+    """Fetch the first bytes of a stream so a dead URL is caught before playback"""
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            async with session.get(url, headers={'Range': 'bytes=0-1'}) as resp:
+                return resp.status < 400
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+async def prefetch_next(chat_id):
+    """Make sure the next queued song has a stream URL that will still work"""
+    if not queues.get(chat_id):
+        return
+    song = queues[chat_id][0]
+    if audio_cache.lookup(song.video_id):
+        return
+    url = await resolve_stream_url(song)
+    if PREFETCH_WARMUP and url and not await warm_up_url(url):
+        await resolve_stream_url(song, force=True)
+
+def admit_request(message, query, cost=1, user=None, cached=None):
+    """Throttle per user and chat, and shed new extractions while the extractor is overloaded
+
+    user: who asked, if not the message's sender (a button press); cached: whether the query needs no extraction"""
+    user_id = (user or message.from_user).id
+    if is_sudo(user_id):
+        return True
+    throttled = command_throttle.check(user_id, message.chat.id, cost)
+    if throttled:
+        scope, wait = throttled
+        outbox.send_message(
+            app,
+            message.chat.id,
+            f"⏳ **Slow down!** {'You are' if scope == 'user' else 'This chat is'} sending requests too fast, "
+            f"try again in {max(1, round(wait))}s.",
+            key=(message.chat.id, 'throttled')
+        )
+        return False
+    if extractor.overloaded and not (cached_video_id(query) if cached is None else cached):
+        THROTTLED.inc(scope='overload')
+        outbox.reply(message, "🚦 **Bot is busy right now!** Please try again in a minute.")
+        return False
+    return True
+
+def is_playlist_url(query, explicit=False):
+    """Playlist links; for /play a watch URL that merely carries list= stays a single track"""
+    if not query.startswith(('http://', 'https://')):
+        return False
+    if any(marker in query for marker in ('/playlist', '/sets/', '/album/')):
+        return True
+    return 'list=' in query and (explicit or 'v=' not in query)
+
+def song_from_entry(entry, user):
+    """Song for a flat playlist entry; its stream is resolved when it comes up"""
+    youtube = entry['platform'] == 'YouTube' and entry['id']
+    return Song(
+        title=entry['title'],
+        duration=entry['duration'],
+        video_id=entry['id'],
+        requester_id=user.id,
+        requester_name=user.first_name or "User",
+        platform=entry['platform'],
+        source=None if youtube else entry['page_url']
+    )
+
+def cancel_playlist_load(chat_id):
+    task = playlist_loads.pop(chat_id, None)
+    if task:
+        task.cancel()
+
 def format_duration(seconds):
     """Format duration"""
     if not seconds:
@@ -192,52 +307,101 @@ def get_control_buttons():
         ]
     ])
 
+def no_voice_chat(chat_id, song):
+    logger.error(f"No active voice chat found in {chat_id}. Cannot play.")
+    # Put the song back and stop attempting to play
+    queues[chat_id].appendleft(song)
+    current_playing.pop(chat_id, None)
+
+async def resolve_alternate_url(song):
+    """Stream URL in another format/player client, for when the usual one keeps failing"""
+    try:
+        song_info = await extractor.extract(song.page_url, profile='fallback')
+    except Exception as e:
+        logger.warning(f"Alternate format extraction failed for {song.title}: {e}")
+        return None
+    return song_info['url'] if song_info else None
+
+async def restart_stream(chat_id, attempt, position):
+    """One recovery attempt: a fresh URL first, then the local copy (if cached) or another format"""
+    song = current_playing.get(chat_id)
+    if song is None:
+        # Stopped or skipped in the meantime
+        return True
+    if attempt == 0:
+        url = await resolve_stream_url(song, force=True)
+    else:
+        url = (attempt == 1 and audio_cache.lookup(song.video_id)) or await resolve_alternate_url(song)
+    if current_playing.get(chat_id) is not song:
+        # Moved on while the URL was resolved; restarting now would play the old song under the new one's name
+        return True
+    if not url:
+        return False
+    try:
+        await backend.play(chat_id, url, seek=int(position), quality=quality.tier_for(chat_id))
+    except NoActiveGroupCall:
+        raise
+    except Exception as e:
+        logger.warning(f"Recovery attempt {attempt + 1} failed in {chat_id}: {e}")
+        return False
+    logger.info(f"Recovered {song.title} in {chat_id} on attempt {attempt + 1}")
+    return True
+
 async def play_next(chat_id):
     """Play next song in the queue with error handling"""
     try:
         if chat_id in queues and queues[chat_id]:
-            song = queues[chat_id].pop(0)
+            song = queues[chat_id].popleft()
             current_playing[chat_id] = song
-            bot_stats['played'] += 1
+            usage.record('plays')
+            state_store.mark_value('played')
             
             logger.info(f"Attempting to play: {song.title} in {chat_id}")
             
-            # Create audio stream (relies on FFmpeg)
-            audio_stream = AudioPiped(
-                song.url,
-                HighQualityAudio()
-            )
+            # Local copy of a hot track, else usually a stream cache hit thanks to the prefetcher
+            url = audio_cache.lookup(song.video_id) or await resolve_stream_url(song)
+            audio_cache.record_play(song)
+            if not url:
+                logger.error(f"Could not resolve a stream URL for {song.title} in {chat_id}, skipping to the next song")
+                current_playing.pop(chat_id, None)
+                # Next song, or leave the call if that was the last one
+                return await play_next(chat_id)
             
             try:
-                # Try to join and play
-                await pytgcalls.play(chat_id, audio_stream)
-                logger.info(f"Successfully started playing {song.title} in {chat_id}")
-                return song
-                
-            except AlreadyJoinedError:
-                # Bot is already in call, change stream
-                await pytgcalls.change_stream(chat_id, audio_stream)
-                logger.info(f"Changed stream to {song.title} in {chat_id}")
-                return song
+                # Relies on FFmpeg wherever the chat's stream runs; the tier only changes on the next song
+                tier = quality.tier_for(chat_id)
+                if await backend.play(chat_id, url, quality=tier):
+                    logger.info(f"Successfully started playing {song.title} in {chat_id} ({tier} quality)")
+                else:
+                    logger.info(f"Changed stream to {song.title} in {chat_id} ({tier} quality)")
                 
             except NoActiveGroupCall:
-                logger.error(f"No active voice chat found in {chat_id}. Cannot play.")
-                # Put the song back and stop attempting to play
-                queues[chat_id].insert(0, song)
-                current_playing.pop(chat_id, None)
+                no_voice_chat(chat_id, song)
                 return None
                 
             except Exception as e:
-                # Catch streaming/FFmpeg errors
-                logger.error(f"Critical PyTgCalls play/change_stream error in {chat_id}: {e}", exc_info=True)
-                current_playing.pop(chat_id, None)
-                return None
+                # Streaming/FFmpeg errors: retry with a fresh URL, the local copy or another format
+                logger.error(f"PyTgCalls play/change_stream error in {chat_id}: {e}", exc_info=True)
+                try:
+                    recovered = await supervisor.recover(chat_id, 'play_failed')
+                except NoActiveGroupCall:
+                    no_voice_chat(chat_id, song)
+                    return None
+                if not recovered:
+                    logger.warning(f"Giving up on {song.title} in {chat_id}, skipping to the next song")
+                    current_playing.pop(chat_id, None)
+                    return await play_next(chat_id)
+            
+            # Re-resolve the next song shortly before this one ends
+            prefetcher.schedule(chat_id, song.duration, lambda: prefetch_next(chat_id))
+            return song
         else:
             # Queue empty, leave VC
             current_playing.pop(chat_id, None)
+            prefetcher.cancel(chat_id)
             logger.info(f"Queue empty in {chat_id}. Leaving voice chat.")
             try:
-                await pytgcalls.leave_group_call(chat_id)
+                await backend.leave(chat_id)
             except NotInGroupCallError:
                  logger.warning(f"Tried to leave {chat_id} but bot was not in call.")
             except Exception as e:
@@ -247,34 +411,122 @@ async def play_next(chat_id):
     except Exception as e:
         logger.critical(f"Unexpected error in play_next function for {chat_id}: {e}", exc_info=True)
         return None
+    finally:
+        # Every branch above changes the queue or the current song
+        queue_changed(chat_id)
+
+async def start_playback(chat_id):
+    """Start the queue unless another request already did"""
+    if chat_id in current_playing:
+        raise StaleEvent(chat_id)
+    return await play_next(chat_id)
+
+async def stop_playback(chat_id):
+    """Leave the voice chat and drop the queue"""
+    await backend.leave(chat_id)
+    cancel_playlist_load(chat_id)
+    queues[chat_id].clear()
+    current_playing.pop(chat_id, None)
+    prefetcher.cancel(chat_id)
+    queue_changed(chat_id)
+
+async def recover_playback(chat_id, reason, position):
+    """Restart a stalled or lost stream where it stopped, or move on to the next song if it cannot be saved"""
+    if await supervisor.recover(chat_id, reason, position):
+        return current_playing.get(chat_id)
+    logger.warning(f"Could not recover the stream in {chat_id}, skipping the song")
+    return await play_next(chat_id)
+
+async def pause_playback(chat_id):
+    await backend.pause(chat_id)
+    supervisor.pause(chat_id)
+
+async def resume_playback(chat_id):
+    await backend.resume(chat_id)
+    supervisor.resume(chat_id)
+
+# Every change to what a chat is playing goes through its actor, so concurrent skips and stream ends cannot double-pop
+players.bind(current_playing, {
+    'play': start_playback,
+    'skip': play_next,
+    'stream_end': play_next,
+    'recover': recover_playback,
+    'stop': stop_playback,
+    'pause': pause_playback,
+    'resume': resume_playback
+})
 
 # --- PyTgCalls Handler ---
 
-@pytgcalls.on_stream_end()
-async def stream_end_handler(client, update):
+@profiler.profile
+async def stream_end_handler(chat_id):
     """Handle stream end to play the next song"""
-    chat_id = update.chat_id
     logger.info(f"Stream ended in {chat_id}. Playing next...")
-    song = await play_next(chat_id)
+    try:
+        song = await players.send(chat_id, 'stream_end')
+    except StaleEvent:
+        # The song was skipped or stopped before its end event came through
+        logger.info(f"Ignoring a stale stream end in {chat_id}")
+        return
     
     if song:
-        try:
-            await app.send_message(
-                chat_id,
-                f"🎵 **Now Playing:**\n📀 {song.title}",
-                reply_markup=get_control_buttons()
-            )
-        except Exception as e:
-             logger.error(f"Error sending 'Now Playing' message in {chat_id}: {e}")
+        # Queued through the outbox; a backlog of track changes only sends the latest one
+        outbox.send_message(
+            app,
+            chat_id,
+            f"🎵 **Now Playing:**\n📀 {song.title}",
+            key=(chat_id, 'now_playing'),
+            reply_markup=get_control_buttons()
+        )
+
+async def recover_stream(chat_id, song, position, reason='stall'):
+    """Recover a stalled or lost stream in the chat's actor; a skip or stop that got there first wins"""
+    try:
+        next_song = await players.send(chat_id, 'recover', song, (reason, position))
+    except StaleEvent:
+        logger.info(f"Stream in {chat_id} changed before its stall recovery ran")
+        return
+    if next_song is not None and next_song is not song:
+        outbox.send_message(
+            app,
+            chat_id,
+            f"🎵 **Now Playing:**\n📀 {next_song.title}",
+            key=(chat_id, 'now_playing'),
+            reply_markup=get_control_buttons()
+        )
+
+async def stream_lost_handler(chat_id):
+    """The chat's streaming worker died: play the song again from where it was last seen"""
+    song = current_playing.get(chat_id)
+    if song is None:
+        return
+    progress = supervisor.progress.get(chat_id)
+    position = progress[1] if progress and progress[0] is song and progress[1] else 0
+    # The new call starts unpaused
+    supervisor.resume(chat_id)
+    await recover_stream(chat_id, song, position, reason='worker_exit')
+
+backend.on_stream_end(stream_end_handler)
+backend.on_stream_lost(stream_lost_handler)
+supervisor.bind(backend, current_playing, restart_stream, recover_stream)
 
 # --- Pyrogram Command Handlers ---
 
+@app.on_chat_member_updated()
+@profiler.profile
+async def chat_member_updated_handler(client, update: ChatMemberUpdated):
+    """Keep the admin cache in sync with promotions and demotions"""
+    member = update.new_chat_member or update.old_chat_member
+    if not member or not member.user:
+        return
+    is_now_admin = bool(update.new_chat_member) and update.new_chat_member.status in ADMIN_STATUSES
+    admin_cache.update_member(update.chat.id, member.user.id, is_now_admin)
+
 @app.on_message(filters.command("start"))
+@profiler.profile
 async def start_command(client, message: Message):
     """Start command (Resso removed)"""
-    bot_stats['users'].add(message.from_user.id)
-    if message.chat.type != "private":
-        bot_stats['chats'].add(message.chat.id)
+    track_usage(message.from_user.id, message.chat.id if message.chat.type != "private" else None)
     
     start_text = f"""
 🎵 **THIS IS {BOT_NAME.upper()}!**
@@ -302,6 +554,7 @@ async def start_command(client, message: Message):
     )
 
 @app.on_message(filters.command("help"))
+@profiler.profile
 async def help_command(client, message: Message):
     """Help command"""
     await message.reply_text(
@@ -321,23 +574,25 @@ async def help_command(client, message: Message):
     )
 
 @app.on_message(filters.command(["play", "p"]) & ~filters.private)
+@profiler.profile
 async def play_command(client, message: Message):
     """Play music"""
     chat_id = message.chat.id
     user_id = message.from_user.id
+    received = time.perf_counter()
     
     if maintenance_mode and not is_sudo(user_id):
-        await message.reply_text("🔧 **Bot is under maintenance!**")
+        outbox.reply(message, "🔧 **Bot is under maintenance!**")
         return
     
     if user_id in blocked_users or chat_id in blocked_chats:
         return
     
-    bot_stats['users'].add(user_id)
-    bot_stats['chats'].add(chat_id)
+    track_usage(user_id, chat_id)
     
     if len(message.command) < 2:
-        await message.reply_text(
+        outbox.reply(
+            message,
             "❌ **Usage:** `/play <song name>`\n\n"
             "**Example:** `/play faded`\n\n"
             "**Important:**\n"
@@ -347,14 +602,28 @@ async def play_command(client, message: Message):
         )
         return
     
-    query = message.text.split(None, 1)[1]
-    status_msg = await message.reply_text("🔍 **Searching and Preparing Stream...**")
+    if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+        outbox.reply(message, f"❌ **Queue is full!** (max {MAX_QUEUE_SIZE} songs)")
+        return
     
+    query = message.text.split(None, 1)[1]
+    if not admit_request(message, query):
+        return
+    if is_playlist_url(query):
+        await play_playlist(message, query)
+        return
+    # Not awaited: the extraction starts now instead of after the chat's next outbox slot
+    status_msg = outbox.status(message, "🔍 **Searching and Preparing Stream...**")
+    await play_query(chat_id, message.from_user, query, status_msg, received)
+
+async def play_query(chat_id, user, query, status_msg, received):
+    """Resolve a query or URL, queue it and start playback if the chat is idle, reporting on status_msg"""
     try:
         song_info = await download_song(query)
         
         if not song_info:
-            await status_msg.edit_text(
+            outbox.edit(
+                status_msg,
                 "❌ **Could not find or process the song!**\n\n"
                 "**Try:**\n"
                 "• Different song name\n"
@@ -363,23 +632,40 @@ async def play_command(client, message: Message):
             )
             return
         
+        video_id = song_info.get('id')
+        page_url = song_info.get('webpage_url')
         song = Song(
             title=song_info['title'],
             duration=song_info['duration'],
-            url=song_info['url'],
-            thumbnail=song_info['thumbnail'],
-            requester=message.from_user.mention
+            video_id=video_id,
+            requester_id=user.id,
+            requester_name=user.first_name or "User",
+            # Only non-YouTube sources need their page URL kept
+            source=None if video_id and page_url == f"https://www.youtube.com/watch?v={video_id}" else (page_url or query)
         )
         
+        if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+            # Filled up by other requests while this one was extracting
+            outbox.edit(status_msg, f"❌ **Queue is full!** (max {MAX_QUEUE_SIZE} songs)")
+            return
+        
         is_playing = chat_id in current_playing
         queues[chat_id].append(song)
+        queue_changed(chat_id)
+        
+        if not is_playing:
+            outbox.edit(status_msg, "🎵 **Joining Voice Chat and Starting Playback...**")
+            try:
+                playing_song = await players.send(chat_id, 'play')
+            except StaleEvent:
+                # Another request started playback first; this song waits in the queue
+                is_playing = True
         
         if not is_playing:
-            await status_msg.edit_text("🎵 **Joining Voice Chat and Starting Playback...**")
-            playing_song = await play_next(chat_id)
-            
             if playing_song:
-                await status_msg.edit_text(
+                PLAY_LATENCY_SECONDS.observe(time.perf_counter() - received)
+                outbox.edit(
+                    status_msg,
                     f"🎵 **Now Playing:**\n\n"
                     f"📀 {playing_song.title}\n"
                     f"⏱ {format_duration(playing_song.duration)}\n"
@@ -387,7 +673,8 @@ async def play_command(client, message: Message):
                     reply_markup=get_control_buttons()
                 )
             else:
-                await status_msg.edit_text(
+                outbox.edit(
+                    status_msg,
                     "❌ **Failed to play!**\n\n"
                     "**Checklist:**\n"
                     "✅ Voice chat started?\n"
@@ -396,7 +683,8 @@ async def play_command(client, message: Message):
                     "Fix these and try again!"
                 )
         else:
-            await status_msg.edit_text(
+            outbox.edit(
+                status_msg,
                 f"✅ **Added to Queue!**\n\n"
                 f"📀 {song.title}\n"
                 f"⏱ {format_duration(song.duration)}\n"
@@ -405,91 +693,454 @@ async def play_command(client, message: Message):
             
     except Exception as e:
         logger.error(f"Play command final error: {e}", exc_info=True)
-        await status_msg.edit_text(
+        outbox.edit(
+            status_msg,
             f"❌ **An unexpected error occurred!**\n\n"
             f"Error: `{str(e)[:150]}`\n\n"
             "Contact support if this persists."
         )
 
+@app.on_message(filters.command(["search", "find"]) & ~filters.private)
+@profiler.profile
+async def search_command(client, message: Message):
+    """List the top results for a query; only the one picked gets its stream resolved"""
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    
+    if maintenance_mode and not is_sudo(user_id):
+        outbox.reply(message, "🔧 **Bot is under maintenance!**")
+        return
+    
+    if user_id in blocked_users or chat_id in blocked_chats:
+        return
+    
+    track_usage(user_id, chat_id)
+    
+    if len(message.command) < 2:
+        outbox.reply(message, "❌ **Usage:** `/search <song name>`")
+        return
+    
+    query = message.text.split(None, 1)[1]
+    if not admit_request(message, query, cached=results_cache.peek(normalize_query(query)) is not None):
+        return
+    status_msg = outbox.status(message, "🔍 **Searching...**")
+    results = [entry for entry in await search_results(query) if entry['id']]
+    if not results:
+        outbox.edit(status_msg, "❌ **No results found!**")
+        return
+    
+    lines = [f"🔍 **Results for** `{query[:64]}`:\n"]
+    buttons = []
+    for n, entry in enumerate(results, 1):
+        lines.append(f"**{n}.** {entry['title']} ({format_duration(entry['duration'])})")
+        buttons.append([InlineKeyboardButton(f"{n}. {entry['title'][:48]}", callback_data=f"pick:{entry['id']}")])
+    lines.append("\nPick one to play it.")
+    outbox.edit(status_msg, "\n".join(lines), reply_markup=InlineKeyboardMarkup(buttons))
+
+@app.on_message(filters.command(["playlist", "pl"]) & ~filters.private)
+@profiler.profile
+async def playlist_command(client, message: Message):
+    """Play a playlist: the first track starts right away, the rest is queued in the background"""
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    
+    if maintenance_mode and not is_sudo(user_id):
+        outbox.reply(message, "🔧 **Bot is under maintenance!**")
+        return
+    
+    if user_id in blocked_users or chat_id in blocked_chats:
+        return
+    
+    track_usage(user_id, chat_id)
+    
+    if len(message.command) < 2 or not is_playlist_url(message.command[1], explicit=True):
+        outbox.reply(message, "❌ **Usage:** `/playlist <YouTube/SoundCloud playlist URL>`")
+        return
+    
+    url = message.command[1]
+    if not admit_request(message, url):
+        return
+    await play_playlist(message, url)
+
+async def play_playlist(message, url):
+    """List the first few entries, start playing, and hand the rest to a background loader"""
+    chat_id = message.chat.id
+    received = time.perf_counter()
+    
+    if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+        outbox.reply(message, f"❌ **Queue is full!** (max {MAX_QUEUE_SIZE} songs)")
+        return
+    
+    status_msg = outbox.status(message, "📃 **Loading playlist...**")
+    try:
+        # A few entries rather than one: if the first is unplayable (private, removed, geo-blocked), play_next
+        # skips to the next one instead of the whole playlist failing
+        first_end = max(1, PLAYLIST_FIRST_BATCH)
+        first = await extractor.playlist(url, 1, first_end)
+    except Exception as e:
+        logger.error(f"Playlist extraction failed for {url}: {e}")
+        first = None
+    if not first or not first['entries']:
+        outbox.edit(status_msg, "❌ **Could not load the playlist!** Is it public?")
+        return
+    
+    if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+        outbox.edit(status_msg, f"❌ **Queue is full!** (max {MAX_QUEUE_SIZE} songs)")
+        return
+    
+    room = MAX_QUEUE_SIZE - len(queues[chat_id])
+    songs = [song_from_entry(entry, message.from_user) for entry in first['entries'][:room]]
+    queues[chat_id].extend(songs)
+    queue_changed(chat_id)
+    
+    playing_song = None
+    if chat_id not in current_playing:
+        try:
+            playing_song = await players.send(chat_id, 'play')
+        except StaleEvent:
+            # Another request started playback first; the playlist waits in the queue
+            pass
+        else:
+            if not playing_song:
+                outbox.edit(status_msg, "❌ **Failed to play!** Start the voice chat and make sure I'm an admin.")
+                return
+    if playing_song:
+        PLAY_LATENCY_SECONDS.observe(time.perf_counter() - received)
+        header = f"🎵 **Now Playing:**\n\n📀 {playing_song.title}\n⏱ {format_duration(playing_song.duration)}"
+    else:
+        header = f"✅ **Added to Queue!**\n\n📀 {songs[0].title}"
+    outbox.edit(
+        status_msg,
+        f"{header}\n\n📃 **{first['title']}**: loading the remaining tracks...",
+        reply_markup=get_control_buttons()
+    )
+    
+    # A newer playlist in the same chat takes over from an unfinished one
+    cancel_playlist_load(chat_id)
+    task = asyncio.ensure_future(load_playlist(chat_id, url, message.from_user, first['title'], status_msg, header,
+                                               first_end + 1, len(songs)))
+    playlist_loads[chat_id] = task
+
+async def load_playlist(chat_id, url, user, title, status_msg, header, start, added):
+    """Append the rest of a playlist, from entry `start`, in batches until it ends or the queue is full"""
+    full = False
+    try:
+        while True:
+            if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+                full = True
+                break
+            end = start + PLAYLIST_BATCH_SIZE - 1
+            batch = await extractor.playlist(url, start, end)
+            entries = batch['entries'] if batch else []
+            # /play may have queued songs while the batch was listed
+            room = max(0, MAX_QUEUE_SIZE - len(queues[chat_id]))
+            songs = [song_from_entry(entry, user) for entry in entries[:room]]
+            queues[chat_id].extend(songs)
+            added += len(songs)
+            queue_changed(chat_id)
+            if len(entries) > room:
+                full = True
+                break
+            # A short batch is not the end: private/deleted entries are left out of it
+            if not batch or not batch['listed'] or (batch['count'] and end >= batch['count']):
+                break
+            start += PLAYLIST_BATCH_SIZE
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Loading playlist {url} in {chat_id} stopped after {added} tracks: {e}")
+    finally:
+        if playlist_loads.get(chat_id) is asyncio.current_task():
+            del playlist_loads[chat_id]
+    logger.info(f"Queued {added} tracks from playlist {url} in {chat_id}")
+    outbox.edit(
+        status_msg,
+        f"{header}\n\n📃 **{title}**: {added} tracks queued" + (" (queue is full)" if full else ""),
+        reply_markup=get_control_buttons()
+    )
+
 @app.on_message(filters.command("pause") & ~filters.private)
+@profiler.profile
 async def pause_command(client, message: Message):
     """Pause"""
     if not await is_admin(message.chat.id, message.from_user.id):
-        await message.reply_text("❌ **Only admins!**")
+        outbox.reply(message, "❌ **Only admins!**")
         return
     try:
-        await pytgcalls.pause_stream(message.chat.id)
-        await message.reply_text("⏸ **Paused!**")
+        await players.send(message.chat.id, 'pause')
+        outbox.reply(message, "⏸ **Paused!**")
     except Exception as e:
-        await message.reply_text(f"❌ **Error pausing:** {str(e)}")
+        outbox.reply(message, f"❌ **Error pausing:** {str(e)}")
 
 @app.on_message(filters.command("resume") & ~filters.private)
+@profiler.profile
 async def resume_command(client, message: Message):
     """Resume"""
     if not await is_admin(message.chat.id, message.from_user.id):
-        await message.reply_text("❌ **Only admins!**")
+        outbox.reply(message, "❌ **Only admins!**")
         return
     try:
-        await pytgcalls.resume_stream(message.chat.id)
-        await message.reply_text("▶️ **Resumed!**")
+        await players.send(message.chat.id, 'resume')
+        outbox.reply(message, "▶️ **Resumed!**")
     except Exception as e:
-        await message.reply_text(f"❌ **Error resuming:** {str(e)}")
+        outbox.reply(message, f"❌ **Error resuming:** {str(e)}")
 
 @app.on_message(filters.command(["skip", "next"]) & ~filters.private)
+@profiler.profile
 async def skip_command(client, message: Message):
     """Skip"""
+    chat_id = message.chat.id
+    # The song this skip is about, taken before the admin check can let a stream end slip in
+    target = current_playing.get(chat_id)
     if not await is_admin(message.chat.id, message.from_user.id):
-        await message.reply_text("❌ **Only admins!**")
+        outbox.reply(message, "❌ **Only admins!**")
         return
-    chat_id = message.chat.id
-    if chat_id in current_playing:
-        await message.reply_text("⏭ **Skipping to next song...**")
-        song = await play_next(chat_id)
+    if target is not None:
+        outbox.reply(message, "⏭ **Skipping to next song...**")
+        try:
+            song = await players.send(chat_id, 'skip', target)
+        except StaleEvent:
+            # Skipped by someone else (or ended) while this request waited
+            outbox.reply(message, "⏭ **Already skipped!**")
+            return
         if song:
-            await message.reply_text(
+            outbox.reply(
+                message,
                 f"⏭ **Skipped!**\n\n🎵 {song.title}",
                 reply_markup=get_control_buttons()
             )
         else:
-            await message.reply_text("✅ **Queue finished!**")
+            outbox.reply(message, "✅ **Queue finished!**")
     else:
-        await message.reply_text("❌ **Nothing playing!**")
+        outbox.reply(message, "❌ **Nothing playing!**")
 
 @app.on_message(filters.command(["stop", "end"]) & ~filters.private)
+@profiler.profile
 async def stop_command(client, message: Message):
     """Stop"""
     if not await is_admin(message.chat.id, message.from_user.id):
-        await message.reply_text("❌ **Only admins!**")
+        outbox.reply(message, "❌ **Only admins!**")
         return
     chat_id = message.chat.id
     try:
-        await pytgcalls.leave_group_call(chat_id)
-        queues[chat_id].clear()
-        current_playing.pop(chat_id, None)
-        await message.reply_text("⏹ **Stopped and cleared queue!**")
+        await players.send(chat_id, 'stop')
+        outbox.reply(message, "⏹ **Stopped and cleared queue!**")
     except Exception as e:
-        await message.reply_text(f"❌ **Error stopping:** {str(e)}")
+        outbox.reply(message, f"❌ **Error stopping:** {str(e)}")
+
+def render_queue(chat_id, page=0):
+    """Text and buttons of one /queue page, rebuilt only after the queue has changed"""
+    queue = queues.get(chat_id) or ()
+    pages = max(1, -(-len(queue) // QUEUE_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    version = queue_versions.get(chat_id, 0)
+    cached = queue_pages.get((chat_id, page))
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+    
+    lines = ["📃 **Queue:**", ""]
+    song = current_playing.get(chat_id)
+    if song:
+        lines += ["▶️ **Playing:**", f"`{song.title}`", ""]
+    if queue:
+        lines.append(f"**Next** ({len(queue)} songs):")
+        start = page * QUEUE_PAGE_SIZE
+        lines.extend(
+            f"{i}. `{song.title}` ({format_duration(song.duration)})"
+            for i, song in enumerate(islice(queue, start, start + QUEUE_PAGE_SIZE), start + 1)
+        )
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️ Prev", callback_data=f"queue:{page - 1}"))
+    if pages > 1:
+        buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"queue:{page}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ▶️", callback_data=f"queue:{page + 1}"))
+    markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    
+    text = "\n".join(lines)
+    queue_pages.set((chat_id, page), (version, text, markup))
+    return text, markup
 
 @app.on_message(filters.command("queue") & ~filters.private)
+@profiler.profile
 async def queue_command(client, message: Message):
     """Queue"""
     chat_id = message.chat.id
-    if chat_id not in current_playing and not queues[chat_id]:
-        await message.reply_text("📭 **Queue empty!**")
+    if chat_id not in current_playing and not queues.get(chat_id):
+        outbox.reply(message, "📭 **Queue empty!**")
         return
-    text = "📃 **Queue:**\n\n"
-    if chat_id in current_playing:
-        song = current_playing[chat_id]
-        text += f"▶️ **Playing:**\n`{song.title}`\n\n"
-    if queues[chat_id]:
-        text += "**Next:**\n"
-        for i, song in enumerate(queues[chat_id][:10], 1):
-            text += f"{i}. `{song.title}`\n"
-        if len(queues[chat_id]) > 10:
-             text += f"*{len(queues[chat_id]) - 10} more songs in queue...*"
-    await message.reply_text(text)
+    text, markup = render_queue(chat_id)
+    outbox.reply(message, text, reply_markup=markup)
+
+@app.on_message(filters.command("playmany") & ~filters.private)
+@profiler.profile
+async def playmany_command(client, message: Message):
+    """Queue several songs at once (one per line or separated by ;), extracted in parallel"""
+    chat_id = message.chat.id
+    user_id = message.from_user.id
+    
+    if maintenance_mode and not is_sudo(user_id):
+        outbox.reply(message, "🔧 **Bot is under maintenance!**")
+        return
+    
+    if user_id in blocked_users or chat_id in blocked_chats:
+        return
+    
+    track_usage(user_id, chat_id)
+    
+    text = message.text.split(None, 1)[1] if len(message.command) > 1 else ""
+    queries = [q.strip() for q in text.replace(";", "\n").split("\n") if q.strip()]
+    if not queries:
+        outbox.reply(message, f"❌ **Usage:** `/playmany song one; song two; ...` (up to {MAX_PLAYMANY})")
+        return
+    queries = queries[:MAX_PLAYMANY]
+    
+    room = MAX_QUEUE_SIZE - len(queues[chat_id])
+    if room <= 0:
+        outbox.reply(message, f"❌ **Queue is full!** (max {MAX_QUEUE_SIZE} songs)")
+        return
+    queries = queries[:room]
+    # Shed while overloaded unless every song is already known; one cached query says nothing about the rest
+    if not admit_request(message, queries[0], cost=len(queries),
+                         cached=all(cached_video_id(query) for query in queries)):
+        return
+    
+    status_msg = outbox.status(message, f"🔍 **Searching {len(queries)} songs...**")
+    # All extractions run at once (bounded by the extractor pool), results keep the request order
+    results = await asyncio.gather(*(download_song(query) for query in queries), return_exceptions=True)
+    
+    added, failed = [], []
+    for query, song_info in zip(queries, results):
+        if isinstance(song_info, Exception) or not song_info:
+            failed.append(query)
+            continue
+        if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+            failed.append(query)
+            continue
+        video_id = song_info.get('id')
+        page_url = song_info.get('webpage_url')
+        song = Song(
+            title=song_info['title'],
+            duration=song_info['duration'],
+            video_id=video_id,
+            requester_id=user_id,
+            requester_name=message.from_user.first_name or "User",
+            source=None if video_id and page_url == f"https://www.youtube.com/watch?v={video_id}" else (page_url or query)
+        )
+        queues[chat_id].append(song)
+        added.append(song)
+    if added:
+        queue_changed(chat_id)
+    
+    lines = [f"✅ **Added {len(added)} songs to the queue!**"]
+    lines.extend(f"• {song.title}" for song in added)
+    if failed:
+        lines.append(f"\n❌ **Not added:** {', '.join(failed)}")
+    if added and chat_id not in current_playing:
+        try:
+            playing_song = await players.send(chat_id, 'play')
+        except StaleEvent:
+            playing_song = None
+        if playing_song:
+            lines.insert(0, f"🎵 **Now Playing:** {playing_song.title}\n")
+    outbox.edit(status_msg, "\n".join(lines))
+
+@app.on_message(filters.command("shuffle") & ~filters.private)
+@profiler.profile
+async def shuffle_command(client, message: Message):
+    """Shuffle the upcoming songs"""
+    chat_id = message.chat.id
+    if not await is_admin(chat_id, message.from_user.id):
+        outbox.reply(message, "❌ **Only admins!**")
+        return
+    queue = queues.get(chat_id)
+    if not queue or len(queue) < 2:
+        outbox.reply(message, "❌ **Not enough songs in queue to shuffle!**")
+        return
+    # Shuffling a list is linear; shuffling the deque in place would index into its middle
+    songs = list(queue)
+    random.shuffle(songs)
+    queue.clear()
+    queue.extend(songs)
+    queue_changed(chat_id)
+    outbox.reply(message, f"🔀 **Shuffled {len(songs)} songs!**")
+
+@app.on_message(filters.command("move") & ~filters.private)
+@profiler.profile
+async def move_command(client, message: Message):
+    """Move a queued song to another position"""
+    chat_id = message.chat.id
+    if not await is_admin(chat_id, message.from_user.id):
+        outbox.reply(message, "❌ **Only admins!**")
+        return
+    queue = queues.get(chat_id) or deque()
+    try:
+        src, dst = (int(arg) for arg in message.command[1:3])
+        if len(message.command) != 3 or not (1 <= src <= len(queue) and 1 <= dst <= len(queue)):
+            raise ValueError
+    except ValueError:
+        outbox.reply(message, f"❌ **Usage:** `/move <from> <to>` (positions 1-{len(queue)} as shown in /queue)")
+        return
+    song = queue[src - 1]
+    del queue[src - 1]
+    queue.insert(dst - 1, song)
+    queue_changed(chat_id)
+    outbox.reply(message, f"↕️ **Moved** `{song.title}` **to #{dst}**")
+
+@app.on_message(filters.command("dedupe") & ~filters.private)
+@profiler.profile
+async def dedupe_command(client, message: Message):
+    """Remove songs that are already playing or queued earlier"""
+    chat_id = message.chat.id
+    if not await is_admin(chat_id, message.from_user.id):
+        outbox.reply(message, "❌ **Only admins!**")
+        return
+    queue = queues.get(chat_id)
+    if not queue:
+        outbox.reply(message, "📭 **Queue empty!**")
+        return
+    current = current_playing.get(chat_id)
+    seen = {current.video_id or current.page_url} if current else set()
+    unique = []
+    for song in queue:
+        key = song.video_id or song.page_url
+        if key not in seen:
+            seen.add(key)
+            unique.append(song)
+    removed = len(queue) - len(unique)
+    if removed:
+        queue.clear()
+        queue.extend(unique)
+        queue_changed(chat_id)
+    outbox.reply(message, f"🧹 **Removed {removed} duplicate songs!**" if removed else "✅ **No duplicates in queue!**")
+
+@app.on_message(filters.command("quality") & ~filters.private)
+@profiler.profile
+async def quality_command(client, message: Message):
+    """Show or set the chat's audio quality (auto follows server load)"""
+    chat_id = message.chat.id
+    current = quality.chat_settings.get(chat_id, 'auto')
+    if len(message.command) < 2:
+        outbox.reply(
+            message,
+            f"🎚 **Audio quality:** `{current}` (now streaming new songs at `{quality.tier_for(chat_id)}`)\n\n"
+            f"**Usage:** `/quality <{'|'.join(CHAT_SETTINGS)}>`"
+        )
+        return
+    if not await is_admin(chat_id, message.from_user.id):
+        outbox.reply(message, "❌ **Only admins!**")
+        return
+    setting = message.command[1].lower()
+    if setting not in CHAT_SETTINGS:
+        outbox.reply(message, f"❌ **Usage:** `/quality <{'|'.join(CHAT_SETTINGS)}>`")
+        return
+    quality.set_chat(chat_id, setting)
+    state_store.mark_value('chat_quality')
+    outbox.reply(message, f"🎚 **Audio quality set to** `{setting}`, applies from the next song.")
 
 @app.on_message(filters.command("ping"))
+@profiler.profile
 async def ping_command(client, message: Message):
     """Ping"""
     start = datetime.now()
@@ -503,18 +1154,26 @@ async def ping_command(client, message: Message):
     )
 
 @app.on_message(filters.command("stats"))
+@profiler.profile
 async def stats_command(client, message: Message):
     """Stats"""
+    summary = usage.summary()
+    windows = "\n".join(
+        f"• {label}: {w['plays']} played, peak {w['active_calls']} calls, {w['extraction_failures']} failed lookups"
+        for label, w in summary['windows'].items()
+    )
     await message.reply_text(
         f"📊 **Stats:**\n\n"
-        f"👥 Users: {len(bot_stats['users'])}\n"
-        f"💬 Chats: {len(bot_stats['chats'])}\n"
-        f"🎵 Played: {bot_stats['played']}\n"
-        f"🔧 Active: {len(current_playing)}"
+        f"👥 Users: ~{summary['users']}\n"
+        f"💬 Chats: ~{summary['chats']}\n"
+        f"🎵 Played: {summary['played']}\n"
+        f"🔧 Active: {len(current_playing)}\n\n"
+        f"🕒 **Recent:**\n{windows}"
     )
 
 # Callback handler
 @app.on_callback_query()
+@profiler.profile
 async def callback_handler(client, callback_query: CallbackQuery):
     """Handle callbacks"""
     data = callback_query.data
@@ -544,31 +1203,41 @@ async def callback_handler(client, callback_query: CallbackQuery):
         await callback_query.message.edit_text(
             "**🎵 Play Commands:**\n\n"
             "• `/play <song>` - Play\n"
+            "• `/playlist <url>` - Play a playlist\n"
+            "• `/search <song>` - Pick from the top results\n"
             "• `/pause` - Pause\n"
             "• `/resume` - Resume\n"
             "• `/skip` - Skip\n"
             "• `/stop` - Stop\n"
-            "• `/queue` - Queue",
+            "• `/queue` - Queue\n"
+            "• `/playmany <a; b; c>` - Queue several songs\n"
+            "• `/shuffle`, `/move <from> <to>`, `/dedupe` - Reorder the queue",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="help_main")]])
         )
     
     # Inline Control Buttons Logic
     elif data in ["pause", "resume", "skip", "stop"]:
+        target = current_playing.get(chat_id)
         if not await is_admin(chat_id, user_id):
             await callback_query.answer("❌ Admins only!", show_alert=True)
             return
 
         try:
             if data == "pause":
-                await pytgcalls.pause_stream(chat_id)
+                await players.send(chat_id, 'pause')
                 await callback_query.answer("⏸ Paused!")
             elif data == "resume":
-                await pytgcalls.resume_stream(chat_id)
+                await players.send(chat_id, 'resume')
                 await callback_query.answer("▶️ Resumed!")
             elif data == "skip":
-                song = await play_next(chat_id)
+                try:
+                    song = await players.send(chat_id, 'skip', target)
+                except StaleEvent:
+                    await callback_query.answer("⏭ Already skipped!")
+                    return
                 if song:
-                    await callback_query.message.edit_text(
+                    outbox.edit(
+                        callback_query.message,
                         f"⏭ **Skipped!**\n\n🎵 {song.title}",
                         reply_markup=get_control_buttons()
                     )
@@ -576,31 +1245,176 @@ async def callback_handler(client, callback_query: CallbackQuery):
                 else:
                     await callback_query.answer("✅ Queue finished!", show_alert=True)
             elif data == "stop":
-                await pytgcalls.leave_group_call(chat_id)
-                queues[chat_id].clear()
-                current_playing.pop(chat_id, None)
-                await callback_query.message.edit_text("⏹ **Stopped!**")
+                await players.send(chat_id, 'stop')
+                outbox.edit(callback_query.message, "⏹ **Stopped!**")
                 await callback_query.answer("⏹ Stopped!")
         except Exception as e:
              logger.error(f"Callback error for {data} in {chat_id}: {e}")
              await callback_query.answer(f"❌ Error: {str(e)[:50]}", show_alert=True)
     
+    elif data.startswith("pick:"):
+        # A /search result: nothing was resolved for it until now
+        if maintenance_mode and not is_sudo(user_id):
+            await callback_query.answer("🔧 Bot is under maintenance!", show_alert=True)
+            return
+        if user_id in blocked_users or chat_id in blocked_chats:
+            await callback_query.answer()
+            return
+        if len(queues[chat_id]) >= MAX_QUEUE_SIZE:
+            await callback_query.answer(f"❌ Queue is full! (max {MAX_QUEUE_SIZE} songs)", show_alert=True)
+            return
+        track_usage(user_id, chat_id)
+        received = time.perf_counter()
+        query = f"https://www.youtube.com/watch?v={data.split(':', 1)[1]}"
+        if not admit_request(callback_query.message, query, user=callback_query.from_user):
+            await callback_query.answer()
+            return
+        await callback_query.answer("🎵 Preparing stream...")
+        # A new status message, so the list stays up for others to pick from
+        status_msg = outbox.status(callback_query.message, "🔍 **Preparing Stream...**")
+        await play_query(chat_id, callback_query.from_user, query, status_msg, received)
     elif data == "queue":
         await callback_query.answer("Opening Queue...", show_alert=False)
         await queue_command(client, callback_query.message)
+    elif data.startswith("queue:"):
+        text, markup = render_queue(chat_id, int(data.split(":", 1)[1]))
+        outbox.edit(callback_query.message, text, reply_markup=markup)
+        await callback_query.answer()
 
+# Inline mode: "@bot <song>" in any chat
+@app.on_inline_query()
+@profiler.profile
+async def inline_query_handler(client, inline_query: InlineQuery):
+    """Search results that post `/play <link>` when picked; only that one gets its stream resolved"""
+    query = inline_query.query.strip()
+    user_id = inline_query.from_user.id
+    if len(query) < INLINE_MIN_QUERY or user_id in blocked_users or (maintenance_mode and not is_sudo(user_id)):
+        await inline_query.answer([], cache_time=5)
+        return
+    # Not throttled per user (every keystroke is a query), but no new searches while the extractor is overloaded
+    if extractor.overloaded and results_cache.peek(normalize_query(query)) is None:
+        THROTTLED.inc(scope='overload')
+        await inline_query.answer([], cache_time=5)
+        return
+    
+    results = []
+    for entry in await search_results(query):
+        if not entry['id']:
+            continue
+        details = format_duration(entry['duration'])
+        if entry['uploader']:
+            details += f" • {entry['uploader']}"
+        results.append(InlineQueryResultArticle(
+            id=entry['id'],
+            title=entry['title'],
+            description=details,
+            input_message_content=InputTextMessageContent(f"/play {entry['page_url']}"),
+            thumb_url=f"https://i.ytimg.com/vi/{entry['id']}/hqdefault.jpg"
+        ))
+    await inline_query.answer(results, cache_time=SEARCH_RESULTS_TTL)
+
+
+async def restore_state():
+    """Reload persisted state and resume playback in chats that were active"""
+    global maintenance_mode
+    started = time.perf_counter()
+    state = await state_store.load()
+    
+    sets = state['sets']
+    values = state['values']
+    if 'usage' in values:
+        usage.load(values['usage'])
+    # Seen users/chats used to be stored as full sets: fold them into the counters once, then drop them
+    for name, counter in (('users', usage.users), ('chats', usage.chats)):
+        members = sets.pop(name, None)
+        if members:
+            for member in members:
+                counter.add(member)
+            state_store.mark_set(name)
+            state_store.mark_value('usage')
+    blocked_users.update(sets.pop('blocked_users', ()))
+    blocked_chats.update(sets.pop('blocked_chats', ()))
+    gbanned_users.update(sets.pop('gbanned_users', ()))
+    for name, members in sets.items():
+        if name.startswith('auth:'):
+            auth_users[int(name.split(':', 1)[1])].update(members)
+    usage.played = values.get('played', 0)
+    maintenance_mode = values.get('maintenance_mode', False)
+    # JSON turned the chat IDs into strings
+    quality.chat_settings.update({int(k): v for k, v in values.get('chat_quality', {}).items()})
+    
+    active = []
+    for chat_id, chat_state in state['chats'].items():
+        queue = [Song.from_dict(data) for data in chat_state['queue']]
+        if chat_state['current']:
+            # The interrupted song starts over
+            queue.insert(0, Song.from_dict(chat_state['current']))
+            active.append(chat_id)
+        queues[chat_id].extend(queue)
+    
+    logger.info(f"Restored {len(state['chats'])} chats ({len(active)} active) in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return active
+
+async def resume_chats(chat_ids):
+    """Rejoin voice chats after a restart, a bounded number at a time"""
+    if not chat_ids:
+        return
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(RESTORE_CONCURRENCY)
+    
+    async def resume(chat_id):
+        async with limit:
+            try:
+                return await asyncio.wait_for(players.send(chat_id, 'play'), RESTORE_TIMEOUT) is not None
+            except StaleEvent:
+                # A /play got there first
+                return True
+            except asyncio.TimeoutError:
+                logger.warning(f"Timed out resuming playback in {chat_id}")
+                return False
+    
+    results = await asyncio.gather(*(resume(chat_id) for chat_id in chat_ids))
+    logger.info(f"Resumed {sum(results)}/{len(chat_ids)} chats in {time.perf_counter() - started:.1f}s")
 
 async def main():
     """Main function to start clients"""
-    os.makedirs("downloads", exist_ok=True)
+    started = time.perf_counter()
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    audio_cache.start()
+    
+    extractor.start() # Start extraction pool before anything else spawns threads
+    await health_server.start() # Liveness right away; /ready answers 503 until the clients are up
+    asyncio.ensure_future(extractor.warm_up()) # yt-dlp import and setup, off the startup path
+    active_chats = await restore_state() # Load saved state before handlers can run
     
-    await health_server.start() # Start custom health server
-    await pytgcalls.start()
-    await app.start() # Start Pyrogram client
+    # Assistants/streaming workers and the bot client connect concurrently
+    # (when the bot is its own assistant, starting the backend starts it)
+    clients = [backend.start()]
+    if not backend.starts_bot:
+        clients.append(app.start())
+    await asyncio.gather(*clients)
     
-    logger.info(f"{BOT_NAME} started!")
+    state_store.start()
+    asyncio.ensure_future(monitor_loop_lag())
+    profiler.start()
+    supervisor.start()
+    quality.start(lambda: len(current_playing))
+    usage.start(lambda: len(current_playing), lambda: state_store.mark_value('usage'))
     
-    await asyncio.Event().wait()
+    health_server.readiness = lambda: {'bot': app.is_connected, 'streaming': backend.ready}
+    health_server.streaming = backend.status
+    STARTUP_SECONDS.set(time.perf_counter() - started)
+    logger.info(f"{BOT_NAME} started in {time.perf_counter() - started:.1f}s!")
+    
+    # Resume in the background so a large restore never delays new commands
+    asyncio.ensure_future(resume_chats(active_chats))
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await state_store.stop()
+        await backend.stop()
+        extractor.shutdown()
 
 if __name__ == "__main__":
     app.run(main())
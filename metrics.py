@@ -0,0 +1,176 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds (loop lag and Telegram RPCs up to slow extractions)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def labels(**labels):
+    """Label key for the dicts returned by scrape-time metric functions"""
+    return _label_key(labels)
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        # Optional scrape-time source: returns a number, or {label tuple: number}
+        self.function = function
+
+    def function_samples(self):
+        if not self.function:
+            return
+        result = self.function()
+        if isinstance(result, dict):
+            for key, value in result.items():
+                yield '', key, (), value
+        else:
+            yield '', (), (), result
+
+    def samples(self):
+        """Yield (suffix, label_key, extra_labels, value)"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(key, extra)} {_format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, help, function=None):
+        super().__init__(name, help, function)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        yield from self.function_samples()
+        for key, value in self.values.items():
+            yield '', key, (), value
+
+class Gauge(Metric):
+    """A value that is set directly, or read from a function at scrape time"""
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        super().__init__(name, help, function)
+        self.values = {}
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+    def samples(self):
+        yield from self.function_samples()
+        for key, value in self.values.items():
+            yield '', key, (), value
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # label key -> [bucket counts..., sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield '_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield '_sum', key, (), state[-2]
+            yield '_count', key, (), state[-1]
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+_process = None
+
+def _current_process():
+    # psutil is imported on the first scrape rather than at startup
+    global _process
+    if _process is None:
+        import psutil
+        _process = psutil.Process()
+    return _process
+
+EXTRACTION_SECONDS = registry.register(Histogram(
+    'musicbot_extraction_seconds', 'Time spent resolving a query or URL with yt-dlp'))
+EXTRACTION_FAILURES = registry.register(Counter(
+    'musicbot_extraction_failures_total', 'Extractions that returned nothing, failed or timed out'))
+PLAY_LATENCY_SECONDS = registry.register(Histogram(
+    'musicbot_play_to_first_audio_seconds', 'Time from receiving /play to the stream starting in the voice chat'))
+FLOOD_WAITS = registry.register(Counter(
+    'musicbot_flood_waits_total', 'FloodWait errors received from Telegram'))
+LOOP_LAG_SECONDS = registry.register(Histogram(
+    'musicbot_event_loop_lag_seconds', 'How late the event loop woke up a periodic timer',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)))
+registry.register(Gauge(
+    'musicbot_process_resident_memory_bytes', 'Resident set size of the bot process',
+    function=lambda: _current_process().memory_info().rss))
+registry.register(Gauge(
+    'musicbot_process_cpu_percent', 'CPU usage of the bot process since the previous scrape',
+    function=lambda: _current_process().cpu_percent(None)))
+
+async def monitor_loop_lag(interval=0.5):
+    """Measure how late the loop wakes up from a fixed sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
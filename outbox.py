@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from pyrogram.errors import FloodWait, MessageNotModified
+from ratelimit import TokenBucket
+from metrics import registry, labels, Counter, Gauge, FLOOD_WAITS
+from config import OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_MAX_FLOOD_WAIT
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3
+
+class _Job:
+    __slots__ = ('factory', 'future', 'key', 'attempts')
+
+    def __init__(self, factory, future, key):
+        self.factory = factory
+        self.future = future
+        self.key = key
+        self.attempts = 0
+
+class _ChatQueue:
+    __slots__ = ('bucket', 'jobs', 'busy', 'ready')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.jobs = deque()
+        # A chat has at most one request in flight so its messages keep their order
+        self.busy = False
+        self.ready = False
+
+class PendingReply:
+    """A status reply that may still be queued; edits of it are queued behind it and sent once it exists"""
+
+    __slots__ = ('chat', 'id', 'message', 'future')
+
+    def __init__(self, message, future):
+        self.chat = message.chat
+        # Key for coalescing this message's queued edits; the real message ID is not known yet
+        self.id = object()
+        self.message = message
+        self.future = future
+
+    async def edit_text(self, text, **kwargs):
+        try:
+            sent = await self.future
+        except Exception:
+            # The reply itself was dropped (e.g. a long FloodWait): this update goes out as the reply instead
+            sent = await self.message.reply_text(text, **kwargs)
+            self.future = asyncio.get_running_loop().create_future()
+            self.future.set_result(sent)
+            return sent
+        return await sent.edit_text(text, **kwargs)
+
+def _consume_exception(future):
+    # Fire-and-forget callers never look at the result; failures are logged by the outbox
+    if not future.cancelled():
+        future.exception()
+
+class Outbox:
+    """Central scheduler for outgoing messages: per-chat and global token buckets, coalesced edits, FloodWait backoff"""
+
+    def __init__(self, global_rate=OUTBOX_GLOBAL_RATE, chat_rate=OUTBOX_CHAT_RATE, chat_burst=OUTBOX_CHAT_BURST,
+                 max_flood_wait=OUTBOX_MAX_FLOOD_WAIT):
+        self.global_bucket = TokenBucket(global_rate, max(1, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_flood_wait = max_flood_wait
+        self.chats = {}
+        self.ready = deque()
+        # key -> queued job that later edits of the same message replace
+        self.pending = {}
+        self.wakeup = None
+        self.task = None
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def submit(self, chat_id, factory, key=None):
+        """Queue factory() (a coroutine function doing one RPC) and return a future with its result
+
+        Jobs with the same key replace each other while still queued, so only the latest is sent."""
+        if key is not None:
+            job = self.pending.get(key)
+            if job is not None:
+                job.factory = factory
+                self.coalesced += 1
+                return job.future
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        job = _Job(factory, future, key)
+        if key is not None:
+            self.pending[key] = job
+        queue = self.chats.get(chat_id)
+        if queue is None:
+            queue = self.chats[chat_id] = _ChatQueue(TokenBucket(self.chat_rate, self.chat_burst))
+        queue.jobs.append(job)
+        self._make_ready(chat_id, queue)
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.ensure_future(self._dispatch())
+        self.wakeup.set()
+        return future
+
+    def reply(self, message, text, **kwargs):
+        return self.submit(message.chat.id, lambda: message.reply_text(text, **kwargs))
+
+    def status(self, message, text, **kwargs):
+        """Reply without waiting for the reply to go out; outbox.edit() the returned handle to update it"""
+        return PendingReply(message, self.reply(message, text, **kwargs))
+
+    def edit(self, message, text, **kwargs):
+        return self.submit(message.chat.id, lambda: message.edit_text(text, **kwargs), key=(message.chat.id, message.id))
+
+    def send_message(self, client, chat_id, text, key=None, **kwargs):
+        return self.submit(chat_id, lambda: client.send_message(chat_id, text, **kwargs), key=key)
+
+    def _make_ready(self, chat_id, queue):
+        if queue.jobs and not queue.busy and not queue.ready:
+            queue.ready = True
+            self.ready.append(chat_id)
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now=now)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            # Round robin over chats with queued messages; one busy chat cannot starve the rest
+            chosen, next_at = None, None
+            for _ in range(len(self.ready)):
+                chat_id = self.ready.popleft()
+                delay = self.chats[chat_id].bucket.delay(now=now)
+                if delay <= 0:
+                    chosen = chat_id
+                    break
+                self.ready.append(chat_id)
+                next_at = delay if next_at is None else min(next_at, delay)
+            if chosen is None:
+                if not self.ready:
+                    self._prune()
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), next_at)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            queue = self.chats[chosen]
+            queue.ready = False
+            queue.bucket.consume(now=now)
+            self.global_bucket.consume(now=now)
+            job = queue.jobs.popleft()
+            if job.key is not None and self.pending.get(job.key) is job:
+                del self.pending[job.key]
+            queue.busy = True
+            asyncio.ensure_future(self._deliver(chosen, queue, job))
+
+    async def _deliver(self, chat_id, queue, job):
+        try:
+            result = await job.factory()
+        except FloodWait as e:
+            FLOOD_WAITS.inc(source='outbox')
+            queue.bucket.block(e.value)
+            job.attempts += 1
+            newer = self.pending.get(job.key) if job.key is not None else None
+            if newer is not None:
+                # A newer edit of the same message is already queued and will be sent instead
+                newer.future.add_done_callback(lambda f: _copy_result(f, job.future))
+            elif e.value <= self.max_flood_wait and job.attempts < MAX_ATTEMPTS:
+                logger.warning(f"FloodWait {e.value}s sending to {chat_id}, retrying")
+                queue.jobs.appendleft(job)
+                if job.key is not None:
+                    self.pending[job.key] = job
+            else:
+                self.dropped += 1
+                logger.warning(f"Dropped a message to {chat_id} after FloodWait {e.value}s")
+                job.future.set_exception(e)
+        except MessageNotModified:
+            job.future.set_result(None)
+        except Exception as e:
+            logger.warning(f"Sending to {chat_id} failed: {e}")
+            job.future.set_exception(e)
+        else:
+            self.sent += 1
+            job.future.set_result(result)
+        finally:
+            queue.busy = False
+            if queue.jobs:
+                self._make_ready(chat_id, queue)
+                self.wakeup.set()
+            elif queue.bucket.full:
+                del self.chats[chat_id]
+
+    def _prune(self):
+        """Forget idle chats whose bucket has refilled (keeping them would only cost memory)"""
+        for chat_id in [c for c, q in self.chats.items() if not q.jobs and not q.busy and q.bucket.full]:
+            del self.chats[chat_id]
+
+def _copy_result(source, target):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+# Global instance
+outbox = Outbox()
+
+registry.register(Gauge('musicbot_outbox_queued', 'Outgoing messages waiting for a rate limit slot',
+                        function=lambda: sum(len(q.jobs) for q in outbox.chats.values())))
+registry.register(Counter('musicbot_outbox_messages_total', 'Outgoing messages by outcome', function=lambda: {
+    labels(result='sent'): outbox.sent,
+    labels(result='coalesced'): outbox.coalesced,
+    labels(result='dropped'): outbox.dropped
+}))
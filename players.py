@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from collections import deque
+from metrics import registry, Counter, Gauge
+from logs import log_chat
+
+logger = logging.getLogger(__name__)
+
+# Events aimed at the song playing when they were sent; dropped if it has changed by the time they run
+TARGETED = ('skip', 'stream_end', 'recover')
+
+PLAYER_EVENTS = registry.register(Counter(
+    'musicbot_player_events_total', 'Playback events handled by chat actors, by type and outcome'))
+
+class StaleEvent(Exception):
+    """The event no longer applies (its song was already skipped, ended or stopped, or playback already started)"""
+
+# send() default: target whatever is playing when the event is sent
+CURRENT = object()
+
+class _Event:
+    __slots__ = ('op', 'target', 'args', 'key', 'future')
+
+    def __init__(self, op, target, args, key, future):
+        self.op = op
+        self.target = target
+        self.args = args
+        self.key = key
+        self.future = future
+
+class ChatActor:
+    """One chat's mailbox; exists only while the chat has events to process"""
+
+    __slots__ = ('chat_id', 'mailbox', 'pending', 'task')
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.mailbox = deque()
+        # (op, target) -> queued event, so repeated clicks and duplicate stream ends share one run
+        self.pending = {}
+        self.task = None
+
+def _settle(future, result=None, error=None):
+    # The sender may have given up (e.g. a timed out wait_for) and cancelled it
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+class Players:
+    """Per-chat actors: a chat's play/skip/stop/stream-end/pause events run one at a time in arrival order,
+    different chats run in parallel"""
+
+    def __init__(self):
+        self.actors = {}
+        self.handlers = {}
+        self.playing = None
+
+    def bind(self, playing, handlers):
+        """playing: {chat_id: song}; handlers: {op: async handler(chat_id, *args)}, only ever run inside the chat's actor"""
+        self.playing = playing
+        self.handlers = handlers
+
+    def send(self, chat_id, op, target=CURRENT, args=()):
+        """Queue an event for the chat and return a future with its handler's result (StaleEvent if dropped)
+
+        target: for skip/stream_end, the song the event is about; take it before the caller's first await,
+        or an event that raced another one would aim at the song that one just started; args: passed to the handler"""
+        if op not in self.handlers:
+            raise ValueError(f"unknown playback event {op!r}")
+        if op not in TARGETED:
+            target = None
+        elif target is CURRENT:
+            target = self.playing.get(chat_id)
+        key = (op, id(target)) if op in TARGETED else None
+        actor = self.actors.get(chat_id)
+        if actor is None:
+            actor = self.actors[chat_id] = ChatActor(chat_id)
+        elif key is not None:
+            event = actor.pending.get(key)
+            if event is not None:
+                PLAYER_EVENTS.inc(op=op, result='coalesced')
+                return event.future
+        event = _Event(op, target, args, key, asyncio.get_running_loop().create_future())
+        actor.mailbox.append(event)
+        if key is not None:
+            actor.pending[key] = event
+        if actor.task is None:
+            actor.task = asyncio.ensure_future(self._run(actor))
+        return event.future
+
+    async def _run(self, actor):
+        chat_id = actor.chat_id
+        # The actor task has its own context, so everything logged while handling this chat carries its ID
+        log_chat.set(chat_id)
+        try:
+            while actor.mailbox:
+                event = actor.mailbox.popleft()
+                if event.key is not None and actor.pending.get(event.key) is event:
+                    del actor.pending[event.key]
+                if event.future.done():
+                    continue
+                if event.key is not None and self.playing.get(chat_id) is not event.target:
+                    PLAYER_EVENTS.inc(op=event.op, result='stale')
+                    logger.debug(f"Dropped stale {event.op} in {chat_id}")
+                    _settle(event.future, error=StaleEvent(chat_id))
+                    continue
+                try:
+                    result = await self.handlers[event.op](chat_id, *event.args)
+                except StaleEvent as e:
+                    PLAYER_EVENTS.inc(op=event.op, result='stale')
+                    _settle(event.future, error=e)
+                except Exception as e:
+                    PLAYER_EVENTS.inc(op=event.op, result='failed')
+                    _settle(event.future, error=e)
+                else:
+                    PLAYER_EVENTS.inc(op=event.op, result='handled')
+                    _settle(event.future, result)
+        finally:
+            # Nothing awaits between the last empty check and here, so no event can be lost
+            del self.actors[chat_id]
+            # Left over only if the actor itself was cancelled (shutdown)
+            for event in actor.mailbox:
+                event.future.cancel()
+
+# Global instance
+players = Players()
+
+registry.register(Gauge('musicbot_player_actors', 'Chats with playback events being processed',
+                        function=lambda: len(players.actors)))
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from config import PREFETCH_LEAD
+
+logger = logging.getLogger(__name__)
+
+class Prefetcher:
+    """Re-resolves the head of a chat's queue shortly before the current track ends"""
+
+    def __init__(self, lead=PREFETCH_LEAD):
+        self.lead = lead
+        self.tasks = {}
+
+    def schedule(self, chat_id, duration, prefetch):
+        """Run prefetch() `lead` seconds before a track of `duration` seconds ends"""
+        self.cancel(chat_id)
+        if not duration:
+            # Live streams have no known end
+            return
+        delay = max(0, duration - self.lead)
+        task = asyncio.ensure_future(self._run(chat_id, delay, prefetch))
+        self.tasks[chat_id] = task
+        task.add_done_callback(lambda t: self.tasks.pop(chat_id, None) if self.tasks.get(chat_id) is t else None)
+
+    async def _run(self, chat_id, delay, prefetch):
+        await asyncio.sleep(delay)
+        try:
+            await prefetch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Prefetch failed in {chat_id}: {e}")
+
+    def cancel(self, chat_id):
+        task = self.tasks.pop(chat_id, None)
+        if task:
+            task.cancel()
+
+# Global instance
+prefetcher = Prefetcher()
@@ -0,0 +1,165 @@
+import asyncio
+import functools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from config import ENABLE_PROFILER, SLOW_HANDLER_THRESHOLD, LOOP_BLOCK_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+class _TimedAwait:
+    """Drives a coroutine step by step, adding up the time each step holds the event loop"""
+
+    __slots__ = ('coro', 'busy', 'worst_step')
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.busy = 0.0
+        self.worst_step = 0.0
+
+    def __await__(self):
+        gen = self.coro.__await__()
+        value, error = None, None
+        while True:
+            started = time.perf_counter()
+            try:
+                yielded = gen.throw(error) if error is not None else gen.send(value)
+            except StopIteration as stop:
+                self._account(started)
+                return stop.value
+            except BaseException:
+                self._account(started)
+                raise
+            self._account(started)
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+    def _account(self, started):
+        step = time.perf_counter() - started
+        self.busy += step
+        if step > self.worst_step:
+            self.worst_step = step
+
+class HandlerStats:
+    __slots__ = ('calls', 'total', 'busy', 'worst_step', 'slow')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.busy = 0.0
+        self.worst_step = 0.0
+        self.slow = 0
+
+class Profiler:
+    """Opt-in loop-lag watchdog and per-handler timing (ENABLE_PROFILER)"""
+
+    def __init__(self, enabled=ENABLE_PROFILER, slow_threshold=SLOW_HANDLER_THRESHOLD,
+                 block_threshold=LOOP_BLOCK_THRESHOLD):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.block_threshold = block_threshold
+        self.handlers = {}
+        self.stalls = deque(maxlen=20)
+        self.max_lag = 0.0
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.thread = None
+
+    def profile(self, func):
+        """Decorator for Pyrogram/PyTgCalls handlers; returns func untouched when disabled"""
+        if not self.enabled:
+            return func
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            timed = _TimedAwait(func(*args, **kwargs))
+            started = time.perf_counter()
+            try:
+                return await timed
+            finally:
+                self._record(name, time.perf_counter() - started, timed)
+
+        return wrapper
+
+    def _record(self, name, total, timed):
+        stats = self.handlers.get(name)
+        if stats is None:
+            stats = self.handlers[name] = HandlerStats()
+        stats.calls += 1
+        stats.total += total
+        stats.busy += timed.busy
+        stats.worst_step = max(stats.worst_step, timed.worst_step)
+        if timed.worst_step >= self.block_threshold:
+            stats.slow += 1
+            logger.warning(f"Handler {name} blocked the event loop for {timed.worst_step * 1000:.0f}ms "
+                           f"(total {total * 1000:.0f}ms)", extra={'op': name, 'latency_ms': round(total * 1000)})
+        elif total >= self.slow_threshold:
+            stats.slow += 1
+            logger.info(f"Slow handler {name}: {total * 1000:.0f}ms ({timed.busy * 1000:.0f}ms on the loop)",
+                        extra={'op': name, 'latency_ms': round(total * 1000)})
+
+    def start(self):
+        """Start the heartbeat on the running loop and the watchdog thread"""
+        if not self.enabled or self.thread:
+            return
+        self.loop_thread_id = threading.get_ident()
+        asyncio.ensure_future(self._beat())
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        logger.info(f"Profiler enabled (block threshold {self.block_threshold * 1000:.0f}ms)")
+
+    async def _beat(self):
+        interval = self.block_threshold / 4
+        while True:
+            before = time.monotonic()
+            self.heartbeat = before
+            await asyncio.sleep(interval)
+            lag = time.monotonic() - before - interval
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        """Runs in its own thread: samples the loop thread's stack while the loop is stuck"""
+        reported = None
+        while True:
+            time.sleep(self.block_threshold / 2)
+            beat = self.heartbeat
+            stalled = time.monotonic() - beat
+            if stalled < self.block_threshold or reported == beat:
+                continue
+            # Report each stall once, while it is still happening
+            reported = beat
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = traceback.format_stack(frame, limit=15) if frame else []
+            self.stalls.append({
+                'at': time.time(),
+                'stalled_ms': round(stalled * 1000),
+                'stack': [line.strip() for line in stack]
+            })
+            logger.warning(f"Event loop blocked for {stalled * 1000:.0f}ms+, stack:\n{''.join(stack)}")
+
+    def report(self, limit=10):
+        """Worst handlers by longest loop-blocking step, plus recent stall samples"""
+        worst = sorted(self.handlers.items(), key=lambda item: item[1].worst_step, reverse=True)[:limit]
+        return {
+            'enabled': self.enabled,
+            'max_loop_lag_ms': round(self.max_lag * 1000, 1),
+            'handlers': [{
+                'handler': name,
+                'calls': stats.calls,
+                'slow_calls': stats.slow,
+                'avg_ms': round(stats.total / stats.calls * 1000, 1),
+                'avg_loop_busy_ms': round(stats.busy / stats.calls * 1000, 2),
+                'worst_block_ms': round(stats.worst_step * 1000, 1)
+            } for name, stats in worst],
+            'recent_stalls': list(self.stalls)
+        }
+
+# Global instance
+profiler = Profiler()
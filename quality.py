@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from pytgcalls.types.input_stream.quality import HighQualityAudio, MediumQualityAudio, LowQualityAudio
+from metrics import registry, Counter, Gauge
+from config import (QUALITY_SAMPLE_INTERVAL, QUALITY_CPU_MEDIUM, QUALITY_CPU_LOW, QUALITY_CALLS_MEDIUM,
+                    QUALITY_CALLS_LOW, QUALITY_HOLD)
+
+logger = logging.getLogger(__name__)
+
+# Cheapest last: fewer channels and a lower bitrate mean less resampling and encoding per call
+TIERS = ('high', 'medium', 'low')
+AUDIO_PARAMETERS = {
+    'high': HighQualityAudio,
+    'medium': MediumQualityAudio,
+    'low': LowQualityAudio
+}
+CHAT_SETTINGS = ('auto',) + TIERS
+
+# Load has to drop this far below a threshold before quality goes back up
+HYSTERESIS = 0.8
+# Weight of the newest CPU sample in the moving average
+CPU_SMOOTHING = 0.3
+
+QUALITY_CHANGES = registry.register(Counter(
+    'musicbot_quality_changes_total', 'Changes of the global audio quality tier'))
+
+class QualityPolicy:
+    """Picks the audio quality for new streams from host CPU, active calls and per-chat settings"""
+
+    def __init__(self, interval=QUALITY_SAMPLE_INTERVAL, cpu_thresholds=(QUALITY_CPU_MEDIUM, QUALITY_CPU_LOW),
+                 call_thresholds=(QUALITY_CALLS_MEDIUM, QUALITY_CALLS_LOW), hold=QUALITY_HOLD):
+        self.interval = interval
+        self.cpu_thresholds = cpu_thresholds
+        self.call_thresholds = call_thresholds
+        self.hold = hold
+        # Index into TIERS
+        self.level = 0
+        self.cpu = 0.0
+        self.calls = 0
+        self.changed_at = time.monotonic()
+        self.calm_since = None
+        # chat_id -> 'high', 'medium' or 'low'; chats without an entry are on auto
+        self.chat_settings = {}
+        self.active_calls = None
+
+    def _pressure(self, factor=1.0):
+        """Tier the current load calls for, with thresholds scaled by factor"""
+        level = 0
+        for i, (cpu, calls) in enumerate(zip(self.cpu_thresholds, self.call_thresholds), 1):
+            if self.cpu >= cpu * factor or self.calls >= calls * factor:
+                level = i
+        return level
+
+    def sample(self, cpu, calls):
+        """Feed one load sample; moves at most one tier per call"""
+        self.cpu = cpu if not self.cpu else self.cpu + CPU_SMOOTHING * (cpu - self.cpu)
+        self.calls = calls
+        now = time.monotonic()
+        if self._pressure() > self.level:
+            # Step down right away, one tier per sample so a brief spike does not go straight to low
+            self.calm_since = None
+            self._set_level(self.level + 1)
+        elif self.level and self._pressure(HYSTERESIS) < self.level:
+            # Step back up only after the load stayed clearly lower for a while
+            if self.calm_since is None:
+                self.calm_since = now
+            elif now - self.calm_since >= self.hold:
+                self.calm_since = now
+                self._set_level(self.level - 1)
+        else:
+            self.calm_since = None
+
+    def _set_level(self, level):
+        logger.info(f"Audio quality for new streams: {TIERS[self.level]} -> {TIERS[level]} "
+                    f"(CPU {self.cpu:.0f}%, {self.calls} calls)")
+        self.level = level
+        self.changed_at = time.monotonic()
+        QUALITY_CHANGES.inc(tier=TIERS[level])
+
+    def tier_for(self, chat_id):
+        """Quality tier for a stream starting now in the chat"""
+        setting = self.chat_settings.get(chat_id)
+        if setting == 'high':
+            # Keeps full quality through moderate load; only the last tier applies
+            return TIERS[self.level if self.level == len(TIERS) - 1 else 0]
+        if setting in TIERS:
+            # A chat can always ask for less than the global tier, never for more
+            return TIERS[max(self.level, TIERS.index(setting))]
+        return TIERS[self.level]
+
+    def set_chat(self, chat_id, setting):
+        if setting == 'auto':
+            self.chat_settings.pop(chat_id, None)
+        else:
+            self.chat_settings[chat_id] = setting
+
+    def start(self, active_calls):
+        """Sample load every interval; active_calls() returns the number of playing chats"""
+        import psutil
+        self.active_calls = active_calls
+        psutil.cpu_percent(None)
+        asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        import psutil
+        while True:
+            await asyncio.sleep(self.interval)
+            # System-wide, so FFmpeg and streaming worker processes count too
+            self.sample(psutil.cpu_percent(None), self.active_calls())
+
+# Global instance
+quality = QualityPolicy()
+
+registry.register(Gauge('musicbot_quality_tier', 'Global audio quality tier for new streams (0 high, 1 medium, 2 low)',
+                        function=lambda: quality.level))
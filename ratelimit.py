@@ -0,0 +1,98 @@
+import time
+from cache import TTLCache
+from metrics import registry, Counter
+from config import USER_COMMAND_RATE, USER_COMMAND_BURST, CHAT_COMMAND_RATE, CHAT_COMMAND_BURST
+
+THROTTLED = registry.register(Counter(
+    'musicbot_throttled_requests_total', 'Commands refused by rate limits or load shedding'))
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        # updated lies in the future while the bucket is blocked
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def consume(self, amount=1, now=None):
+        """Take tokens if there are enough; returns whether it did"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def delay(self, amount=1, now=None):
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(0.0, self.updated - now)
+        if self.tokens < amount:
+            wait += (amount - self.tokens) / self.rate
+        return wait
+
+    def block(self, seconds, now=None):
+        """Empty the bucket and keep it empty for `seconds` (e.g. a FloodWait)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens = 0
+        self.updated = max(self.updated, now + seconds)
+
+    @property
+    def full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class KeyedRateLimiter:
+    """One token bucket per key (user or chat), forgotten once it would have refilled anyway"""
+
+    def __init__(self, rate, burst, maxsize=100000):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = TTLCache(maxsize, burst / rate)
+
+    def delay(self, key, amount=1):
+        """Seconds until `key` may spend `amount` tokens (0 if it may now)"""
+        bucket = self.buckets.peek(key)
+        return bucket.delay(min(amount, self.burst)) if bucket else 0.0
+
+    def consume(self, key, amount=1):
+        bucket = self.buckets.peek(key) or TokenBucket(self.rate, self.burst)
+        # Bulk requests cost up to a full burst, never more than the bucket can hold
+        bucket.consume(min(amount, self.burst))
+        self.buckets.set(key, bucket)
+
+class CommandThrottle:
+    """Per-user and per-chat limits for commands that start extractions"""
+
+    def __init__(self, user_rate=USER_COMMAND_RATE, user_burst=USER_COMMAND_BURST,
+                 chat_rate=CHAT_COMMAND_RATE, chat_burst=CHAT_COMMAND_BURST):
+        self.users = KeyedRateLimiter(user_rate, user_burst)
+        self.chats = KeyedRateLimiter(chat_rate, chat_burst)
+
+    def check(self, user_id, chat_id, cost=1):
+        """Returns (scope, seconds to wait) if throttled, else takes `cost` tokens from both and returns None"""
+        wait = self.users.delay(user_id, cost)
+        if wait > 0:
+            THROTTLED.inc(scope='user')
+            return 'user', wait
+        wait = self.chats.delay(chat_id, cost)
+        if wait > 0:
+            THROTTLED.inc(scope='chat')
+            return 'chat', wait
+        self.users.consume(user_id, cost)
+        self.chats.consume(chat_id, cost)
+        return None
+
+# Global instance
+command_throttle = CommandThrottle()
@@ -0,0 +1,42 @@
+import html
+import sys
+
+class Song:
+    """A queued track; the signed stream URL is not stored, it is resolved just before playback"""
+
+    __slots__ = ('title', 'duration', 'video_id', 'source', 'requester_id', 'requester_name', 'platform')
+
+    def __init__(self, title, duration, video_id, requester_id=0, requester_name="Unknown", platform="YouTube", source=None):
+        self.title = title
+        self.duration = duration
+        self.video_id = video_id
+        # Only set when the page URL can't be rebuilt from the YouTube video ID
+        self.source = source
+        self.requester_id = requester_id
+        self.requester_name = requester_name
+        # A handful of distinct values shared by every queued song
+        self.platform = sys.intern(platform)
+
+    @property
+    def page_url(self):
+        """URL to re-resolve the stream from"""
+        return self.source or f"https://www.youtube.com/watch?v={self.video_id}"
+
+    @property
+    def thumbnail(self):
+        if self.source or not self.video_id:
+            return ''
+        return f"https://i.ytimg.com/vi/{self.video_id}/hqdefault.jpg"
+
+    @property
+    def requester(self):
+        """Requester mention, built on demand instead of kept per song"""
+        return f'<a href="tg://user?id={self.requester_id}">{html.escape(self.requester_name)}</a>'
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        # Ignores fields older versions used to store (url, thumbnail, requester)
+        return cls(**{key: data[key] for key in cls.__slots__ if key in data})
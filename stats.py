@@ -0,0 +1,202 @@
+import asyncio
+import base64
+import hashlib
+import math
+import time
+import zlib
+from metrics import registry, Gauge
+from config import STATS_HLL_PRECISION, STATS_SAMPLE_INTERVAL
+
+MASK64 = (1 << 64) - 1
+
+# Reporting windows and the ring each is answered from (minute buckets for the last hour, hourly for the rest)
+WINDOWS = (('1h', 3600), ('24h', 86400), ('7d', 7 * 86400))
+MINUTE_SLOTS = 60
+HOUR_SLOTS = 7 * 24
+
+def _hash64(value):
+    """Well-mixed 64-bit hash; Telegram IDs are close to sequential, so hash() (the identity for ints) will not do"""
+    if isinstance(value, int):
+        # splitmix64 finalizer
+        x = (value + 0x9E3779B97F4A7C15) & MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+        return x ^ (x >> 31)
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+class HyperLogLog:
+    """Approximate distinct counter: 2**precision one-byte registers, ~1.04/sqrt(2**precision) relative error"""
+
+    __slots__ = ('precision', 'registers', 'inverse_sum', 'zeros')
+
+    def __init__(self, precision=STATS_HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        # Kept up to date on every change so count() is O(1)
+        self.inverse_sum = float(len(self.registers))
+        self.zeros = len(self.registers)
+
+    def add(self, value):
+        """Returns whether the estimate may have changed"""
+        h = _hash64(value)
+        rest_bits = 64 - self.precision
+        index = h >> rest_bits
+        rest = h & ((1 << rest_bits) - 1)
+        rank = rest_bits - rest.bit_length() + 1
+        old = self.registers[index]
+        if rank <= old:
+            return False
+        self.registers[index] = rank
+        self.inverse_sum += 2.0 ** -rank - 2.0 ** -old
+        if old == 0:
+            self.zeros -= 1
+        return True
+
+    def count(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / self.inverse_sum
+        if estimate <= 2.5 * m and self.zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / self.zeros)
+        return int(round(estimate))
+
+    def dump(self):
+        # Mostly zero registers on a small bot, so they compress well
+        return base64.b64encode(zlib.compress(bytes(self.registers))).decode()
+
+    def load(self, data):
+        registers = zlib.decompress(base64.b64decode(data))
+        if len(registers) != len(self.registers):
+            # Saved with another STATS_HLL_PRECISION; start over rather than mix them
+            return False
+        self.registers = bytearray(registers)
+        self.inverse_sum = sum(2.0 ** -r for r in self.registers)
+        self.zeros = self.registers.count(0)
+        return True
+
+class Ring:
+    """Fixed number of time buckets, reused in a circle; each slot remembers which bucket it holds"""
+
+    __slots__ = ('width', 'values', 'buckets')
+
+    def __init__(self, width, slots):
+        self.width = width
+        self.values = [0] * slots
+        self.buckets = [-1] * slots
+
+    def add(self, value, now, peak=False):
+        bucket = int(now // self.width)
+        i = bucket % len(self.values)
+        if self.buckets[i] != bucket:
+            if self.buckets[i] > bucket:
+                # Older than what the slot already holds (clock stepped back): nowhere to put it
+                return
+            self.buckets[i] = bucket
+            self.values[i] = value
+        elif peak:
+            self.values[i] = max(self.values[i], value)
+        else:
+            self.values[i] += value
+
+    def total(self, seconds, now, peak=False):
+        """Sum (or max) over the buckets covering the last `seconds`, at bucket granularity"""
+        current = int(now // self.width)
+        oldest = current - min(len(self.values), math.ceil(seconds / self.width))
+        values = [v for v, b in zip(self.values, self.buckets) if oldest < b <= current]
+        return max(values, default=0) if peak else sum(values)
+
+    def dump(self):
+        return [self.buckets, self.values]
+
+    def load(self, data):
+        buckets, values = data
+        if len(buckets) == len(self.buckets):
+            self.buckets, self.values = list(buckets), list(values)
+
+class Series:
+    """A counter (sum) or a sampled gauge (peak) over the 1h/24h/7d windows"""
+
+    __slots__ = ('peak', 'minutes', 'hours')
+
+    def __init__(self, peak=False):
+        self.peak = peak
+        self.minutes = Ring(60, MINUTE_SLOTS)
+        self.hours = Ring(3600, HOUR_SLOTS)
+
+    def add(self, value, now):
+        self.minutes.add(value, now, self.peak)
+        self.hours.add(value, now, self.peak)
+
+    def window(self, seconds, now):
+        ring = self.minutes if seconds <= self.minutes.width * MINUTE_SLOTS else self.hours
+        return ring.total(seconds, now, self.peak)
+
+class UsageStats:
+    """Constant-memory usage statistics: distinct users/chats and rolling windows of plays, calls and failures"""
+
+    def __init__(self, precision=STATS_HLL_PRECISION, interval=STATS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.users = HyperLogLog(precision)
+        self.chats = HyperLogLog(precision)
+        self.played = 0
+        self.series = {
+            'plays': Series(),
+            'extraction_failures': Series(),
+            'active_calls': Series(peak=True)
+        }
+
+    def seen(self, user_id, chat_id=None):
+        self.users.add(user_id)
+        if chat_id is not None:
+            self.chats.add(chat_id)
+
+    def record(self, name, value=1):
+        if name == 'plays':
+            self.played += value
+        # Wall clock, so windows persisted across a restart still line up
+        self.series[name].add(value, time.time())
+
+    def summary(self):
+        now = time.time()
+        return {
+            'users': self.users.count(),
+            'chats': self.chats.count(),
+            'played': self.played,
+            'windows': {
+                label: {name: series.window(seconds, now) for name, series in self.series.items()}
+                for label, seconds in WINDOWS
+            }
+        }
+
+    def dump(self):
+        return {
+            'users': self.users.dump(),
+            'chats': self.chats.dump(),
+            'series': {name: [series.minutes.dump(), series.hours.dump()] for name, series in self.series.items()}
+        }
+
+    def load(self, data):
+        self.users.load(data['users'])
+        self.chats.load(data['chats'])
+        for name, (minutes, hours) in data.get('series', {}).items():
+            if name in self.series:
+                self.series[name].minutes.load(minutes)
+                self.series[name].hours.load(hours)
+
+    def start(self, active_calls, changed):
+        """Sample active_calls() every interval, then call changed() so the state gets persisted"""
+        asyncio.ensure_future(self._watch(active_calls, changed))
+
+    async def _watch(self, active_calls, changed):
+        while True:
+            self.series['active_calls'].add(active_calls(), time.time())
+            changed()
+            await asyncio.sleep(self.interval)
+
+# Global instance
+usage = UsageStats()
+
+registry.register(Gauge('musicbot_distinct_users', 'Distinct users seen (HyperLogLog estimate)',
+                        function=lambda: usage.users.count()))
+registry.register(Gauge('musicbot_distinct_chats', 'Distinct group chats seen (HyperLogLog estimate)',
+                        function=lambda: usage.chats.count()))
@@ -0,0 +1,196 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+from config import STATE_BACKEND, STATE_DB_PATH, STATE_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class StateBackend:
+    """Storage backend interface; all methods run on the store's writer thread"""
+
+    def load(self):
+        """Return {'chats': {chat_id: state}, 'sets': {name: set}, 'values': {key: value}}"""
+        raise NotImplementedError
+
+    def write(self, batch):
+        """Apply one flushed batch atomically"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class MemoryBackend(StateBackend):
+    """Keeps nothing across restarts (STATE_BACKEND=memory)"""
+
+    def load(self):
+        return {'chats': {}, 'sets': {}, 'values': {}}
+
+    def write(self, batch):
+        pass
+
+class SQLiteBackend(StateBackend):
+    """Single-file SQLite backend (the default)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(
+                "CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY, state TEXT NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS members (name TEXT NOT NULL, member INTEGER NOT NULL,"
+                " PRIMARY KEY (name, member)) WITHOUT ROWID;"
+                "CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL);"
+            )
+        return self.conn
+
+    def load(self):
+        conn = self.connect()
+        chats = {chat_id: json.loads(state) for chat_id, state in conn.execute("SELECT chat_id, state FROM chats")}
+        sets = defaultdict(set)
+        for name, member in conn.execute("SELECT name, member FROM members"):
+            sets[name].add(member)
+        values = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM kv")}
+        return {'chats': chats, 'sets': dict(sets), 'values': values}
+
+    def write(self, batch):
+        conn = self.connect()
+        with conn:
+            for chat_id, state in batch['chats'].items():
+                if state is None:
+                    conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO chats VALUES (?, ?)", (chat_id, json.dumps(state)))
+            for name, members in batch['sets'].items():
+                conn.execute("DELETE FROM members WHERE name = ?", (name,))
+                conn.executemany("INSERT INTO members VALUES (?, ?)", [(name, m) for m in members])
+            conn.executemany(
+                "INSERT OR REPLACE INTO kv VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in batch['values'].items()]
+            )
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+class StateStore:
+    """Write-behind persistence: handlers only mark keys dirty, a background task flushes them in batches"""
+
+    def __init__(self, backend, interval=STATE_FLUSH_INTERVAL):
+        self.backend = backend
+        self.interval = interval
+        # One writer thread keeps SQLite on a single connection and writes ordered
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+        self.dirty_chats = set()
+        self.dirty_sets = set()
+        self.dirty_values = set()
+        self.serialize_chat = None
+        self.sets = {}
+        self.values = {}
+        self.task = None
+        self.last_flush_ms = 0.0
+
+    def bind(self, serialize_chat, sets, values):
+        """Tell the store how to snapshot live state: a chat serializer, named sets and value getters"""
+        self.serialize_chat = serialize_chat
+        self.sets = sets
+        self.values = values
+
+    # --- Hot path: O(1), never touches disk ---
+
+    def mark_chat(self, chat_id):
+        self.dirty_chats.add(chat_id)
+
+    def mark_set(self, name):
+        self.dirty_sets.add(name)
+
+    def mark_value(self, key):
+        self.dirty_values.add(key)
+
+    # --- Background ---
+
+    async def load(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.writer, self.backend.load)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"State flush failed: {e}")
+
+    def _take_batch(self):
+        """Snapshot dirty state on the event loop (cheap) so the writer thread never reads live objects"""
+        batch = {
+            'chats': {chat_id: self.serialize_chat(chat_id) for chat_id in self.dirty_chats},
+            'sets': {},
+            'values': {key: self.values[key]() for key in self.dirty_values if key in self.values}
+        }
+        for name in self.dirty_sets:
+            if ':' in name:
+                # Keyed sets such as "auth:<chat_id>" live in a dict of sets
+                base, key = name.split(':', 1)
+                batch['sets'][name] = list(self.sets[base].get(int(key), ()))
+            elif name in self.sets:
+                batch['sets'][name] = list(self.sets[name])
+            else:
+                # No longer kept as a set: marking it deletes what was persisted
+                batch['sets'][name] = []
+        self.dirty_chats = set()
+        self.dirty_sets = set()
+        self.dirty_values = set()
+        return batch
+
+    async def flush(self):
+        if not (self.dirty_chats or self.dirty_sets or self.dirty_values):
+            return
+        batch = self._take_batch()
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            await loop.run_in_executor(self.writer, self.backend.write, batch)
+        except Exception:
+            # Keep the batch dirty so the next flush retries it
+            self.dirty_chats.update(batch['chats'])
+            self.dirty_sets.update(batch['sets'])
+            self.dirty_values.update(batch['values'])
+            raise
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    async def stop(self):
+        """Cancel the flush loop and write whatever is still pending"""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        try:
+            await self.flush()
+        finally:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.writer, self.backend.close)
+            self.writer.shutdown(wait=False)
+
+def create_store():
+    """Build the state store selected by STATE_BACKEND"""
+    if STATE_BACKEND == "sqlite":
+        return StateStore(SQLiteBackend(STATE_DB_PATH))
+    if STATE_BACKEND != "memory":
+        logger.warning(f"Unknown STATE_BACKEND '{STATE_BACKEND}', state will not persist")
+    return StateStore(MemoryBackend())
+
+# Global instance
+state_store = create_store()
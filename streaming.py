@@ -0,0 +1,322 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+from pyrogram.errors import FloodWait
+from pytgcalls import PyTgCalls
+from pytgcalls.types.input_stream import AudioPiped
+from pytgcalls.exceptions import NoActiveGroupCall, AlreadyJoinedError, NotInGroupCallError, NodeJSNotRunning
+from assistants import assistants, AssistantNotInChat
+from quality import AUDIO_PARAMETERS
+from metrics import registry, labels, Counter, Gauge, FLOOD_WAITS
+from config import SESSION_STRINGS, STREAM_WORKERS, WORKER_CALL_TIMEOUT, WORKER_RESTART_DELAY
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workers.py")
+
+# Errors that cross the worker pipe keep their type so callers can catch them as usual
+WORKER_ERRORS = {cls.__name__: cls for cls in (
+    NoActiveGroupCall, AlreadyJoinedError, NotInGroupCallError, NodeJSNotRunning, AssistantNotInChat, ConnectionError
+)}
+
+WORKER_RESTARTS = registry.register(Counter(
+    'musicbot_stream_worker_restarts_total', 'Streaming worker processes that exited and were restarted'))
+
+def _rebuild_error(name, text):
+    """Recreate an exception raised in a worker (PyTgCalls errors take no arguments)"""
+    error = WORKER_ERRORS.get(name)
+    if error is None:
+        return RuntimeError(f"{name}: {text}")
+    try:
+        return error(text)
+    except TypeError:
+        return error()
+
+class LocalBackend:
+    """Streams voice chats from the assistants in this process"""
+
+    def __init__(self, pool, bot=None):
+        self.pool = pool
+        # Exports invite links for user-session assistants; None inside a worker process
+        self.bot = bot
+        self.handlers = []
+
+    def on_stream_end(self, handler):
+        """Register an async handler(chat_id) for finished tracks"""
+        self.handlers.append(handler)
+        return handler
+
+    def on_stream_lost(self, handler):
+        """Register an async handler(chat_id) for calls dropped by the backend; in-process calls never are"""
+        return handler
+
+    @property
+    def starts_bot(self):
+        """Whether start() also starts the bot client (it is its own assistant)"""
+        return any(assistant.is_bot for assistant in self.pool)
+
+    @property
+    def ready(self):
+        return any(assistant.connected for assistant in self.pool)
+
+    async def _stream_ended(self, client, update):
+        for handler in self.handlers:
+            await handler(update.chat_id)
+
+    async def start(self):
+        for assistant in self.pool:
+            assistant.calls.on_stream_end()(self._stream_ended)
+        await self.pool.start()
+
+    async def stop(self):
+        pass
+
+    async def _invite_link(self, chat_id, invite_link):
+        if invite_link:
+            return invite_link
+        if self.bot is None:
+            raise AssistantNotInChat(chat_id)
+        return await self.bot.export_chat_invite_link(chat_id)
+
+    async def play(self, chat_id, url, invite_link=None, seek=0, quality='high'):
+        """Play on the chat's assistant; returns True if it joined, False if it only changed stream"""
+        # seek (seconds) resumes a recovered stream where it stopped
+        audio_stream = AudioPiped(
+            url,
+            AUDIO_PARAMETERS[quality](),
+            additional_ffmpeg_parameters=f"-ss {seek}" if seek else ''
+        )
+        assistant = self.pool.for_chat(chat_id)
+        # At most one try per assistant, and only on one that is not cooling down itself: when every assistant is
+        # flood-waited or down, retrying right away would only bounce between them and make the flood limits worse
+        attempts = len(self.pool.assistants)
+        for attempt in range(attempts):
+            try:
+                await self.pool.ensure_joined(assistant, chat_id, lambda: self._invite_link(chat_id, invite_link))
+                await assistant.calls.join_group_call(chat_id, audio_stream)
+                return True
+            except AlreadyJoinedError:
+                # Assistant is already in call, change stream
+                await assistant.calls.change_stream(chat_id, audio_stream)
+                return False
+            except NoActiveGroupCall:
+                self.pool.release(chat_id)
+                raise
+            except FloodWait as e:
+                FLOOD_WAITS.inc(source='assistant_join')
+                replacement = self.pool.failover(chat_id, flood_wait=e.value)
+                if replacement is None or not replacement.available or attempt == attempts - 1:
+                    raise
+            except (ConnectionError, NodeJSNotRunning):
+                replacement = self.pool.failover(chat_id)
+                if replacement is None or not replacement.available or attempt == attempts - 1:
+                    raise
+            assistant = replacement
+
+    async def pause(self, chat_id):
+        await self.pool.calls_for(chat_id).pause_stream(chat_id)
+
+    async def resume(self, chat_id):
+        await self.pool.calls_for(chat_id).resume_stream(chat_id)
+
+    async def played_time(self, chat_id):
+        return await self.pool.calls_for(chat_id).played_time(chat_id)
+
+    async def leave(self, chat_id):
+        """Leave the chat's voice chat and free its assistant slot"""
+        try:
+            await self.pool.calls_for(chat_id).leave_group_call(chat_id)
+        finally:
+            self.pool.release(chat_id)
+
+    def status(self):
+        return {'mode': 'local', 'assistants': self.pool.status()}
+
+class WorkerProcess:
+    """Frontend side of one streaming worker: the subprocess and its in-flight jobs"""
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.pending = {}
+        self.ids = itertools.count()
+        self.restarts = 0
+        # Chats with a call on this worker; their streams die with it
+        self.chats = set()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+class ProcessBackend:
+    """Dispatches play/pause/resume/leave jobs to streaming worker processes, each owning a share of the chats"""
+
+    starts_bot = False
+
+    def __init__(self, count, bot):
+        self.bot = bot
+        self.workers = [WorkerProcess(index) for index in range(count)]
+        self.handlers = []
+        self.lost_handlers = []
+        self.stopping = False
+        registry.register(Gauge('musicbot_stream_worker_up', 'Whether each streaming worker process is running', function=lambda: {
+            labels(worker=str(w.index)): int(w.alive) for w in self.workers
+        }))
+
+    def on_stream_end(self, handler):
+        """Register an async handler(chat_id) for finished tracks"""
+        self.handlers.append(handler)
+        return handler
+
+    def on_stream_lost(self, handler):
+        """Register an async handler(chat_id) for chats whose worker died mid-call (called once it is back)"""
+        self.lost_handlers.append(handler)
+        return handler
+
+    @property
+    def ready(self):
+        return any(worker.alive for worker in self.workers)
+
+    def worker_for(self, chat_id):
+        # Fixed sharding: a chat's jobs always reach the same worker, in order
+        return self.workers[chat_id % len(self.workers)]
+
+    async def start(self):
+        await asyncio.gather(*(self._spawn(worker) for worker in self.workers))
+        logger.info(f"Started {len(self.workers)} streaming workers")
+
+    async def _spawn(self, worker):
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT, str(worker.index), str(len(self.workers)),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        asyncio.ensure_future(self._read(worker, worker.process))
+
+    async def _read(self, worker, process):
+        """Route job results to their callers and stream-end events to the handlers"""
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning(f"Worker {worker.index} sent an invalid line: {line[:200]!r}")
+                continue
+            if message.get('event') == 'stream_end':
+                for handler in self.handlers:
+                    asyncio.ensure_future(handler(message['chat_id']))
+                continue
+            future = worker.pending.pop(message.get('id'), None)
+            if future is None or future.done():
+                continue
+            if 'error' in message:
+                future.set_exception(_rebuild_error(message['error'], message.get('message', '')))
+            else:
+                future.set_result(message.get('result'))
+
+        code = await process.wait()
+        for future in worker.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"streaming worker {worker.index} exited"))
+        worker.pending.clear()
+        if self.stopping:
+            return
+        worker.restarts += 1
+        WORKER_RESTARTS.inc(worker=str(worker.index))
+        logger.error(f"Streaming worker {worker.index} exited with code {code}, restarting in {WORKER_RESTART_DELAY}s")
+        await asyncio.sleep(WORKER_RESTART_DELAY)
+        if self.stopping:
+            return
+        await self._spawn(worker)
+        # Its calls are gone with it: have each chat that was playing start again on the new process
+        lost, worker.chats = worker.chats, set()
+        if lost:
+            logger.warning(f"Restarting {len(lost)} streams that were on worker {worker.index}")
+        for chat_id in lost:
+            for handler in self.lost_handlers:
+                asyncio.ensure_future(handler(chat_id))
+
+    async def _call(self, chat_id, op, **args):
+        worker = self.worker_for(chat_id)
+        if not worker.alive:
+            raise ConnectionError(f"streaming worker {worker.index} is not running")
+        request_id = next(worker.ids)
+        future = asyncio.get_running_loop().create_future()
+        worker.pending[request_id] = future
+        try:
+            worker.process.stdin.write(json.dumps({'id': request_id, 'op': op, 'chat_id': chat_id, **args}).encode() + b'\n')
+            await worker.process.stdin.drain()
+            return await asyncio.wait_for(future, WORKER_CALL_TIMEOUT)
+        finally:
+            worker.pending.pop(request_id, None)
+
+    async def play(self, chat_id, url, invite_link=None, seek=0, quality='high'):
+        """Play in the chat's worker; returns True if it joined, False if it only changed stream"""
+        try:
+            joined = await self._call(chat_id, 'play', url=url, invite_link=invite_link, seek=seek, quality=quality)
+        except AssistantNotInChat:
+            # Only the frontend runs the bot, so it hands out the invite link
+            if invite_link:
+                raise
+            link = await self.bot.export_chat_invite_link(chat_id)
+            joined = await self._call(chat_id, 'play', url=url, invite_link=link, seek=seek, quality=quality)
+        self.worker_for(chat_id).chats.add(chat_id)
+        return joined
+
+    async def pause(self, chat_id):
+        await self._call(chat_id, 'pause')
+
+    async def resume(self, chat_id):
+        await self._call(chat_id, 'resume')
+
+    async def played_time(self, chat_id):
+        return await self._call(chat_id, 'played_time')
+
+    async def leave(self, chat_id):
+        try:
+            await self._call(chat_id, 'leave')
+        finally:
+            self.worker_for(chat_id).chats.discard(chat_id)
+
+    async def stop(self):
+        self.stopping = True
+        for worker in self.workers:
+            if worker.alive:
+                # Closing stdin asks the worker to leave its calls and exit
+                worker.process.stdin.close()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), 10)
+            except asyncio.TimeoutError:
+                worker.process.kill()
+
+    def status(self):
+        return {'mode': 'process', 'workers': [{
+            'worker': worker.index,
+            'alive': worker.alive,
+            'calls': len(worker.chats),
+            'pending': len(worker.pending),
+            'restarts': worker.restarts
+        } for worker in self.workers]}
+
+def create_backend(bot):
+    """Streaming backend selected by STREAM_WORKERS"""
+    if STREAM_WORKERS > 0:
+        if SESSION_STRINGS:
+            # A worker without a session would have nothing to stream with
+            return ProcessBackend(min(STREAM_WORKERS, len(SESSION_STRINGS)), bot)
+        logger.warning("STREAM_WORKERS needs SESSION_STRINGS (the bot cannot stream from another process), "
+                       "streaming in-process")
+    if SESSION_STRINGS:
+        assistants.add_sessions(SESSION_STRINGS)
+    else:
+        # Initialize PyTgCalls AFTER app
+        assistants.add(bot, PyTgCalls(bot), is_bot=True)
+    return LocalBackend(assistants, bot)
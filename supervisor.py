@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from pytgcalls.exceptions import NotInGroupCallError
+from metrics import registry, Counter, Histogram
+from config import STALL_CHECK_INTERVAL, STALL_TIMEOUT, STREAM_MAX_RETRIES, STREAM_RETRY_BACKOFF
+
+logger = logging.getLogger(__name__)
+
+STREAM_STALLS = registry.register(Counter(
+    'musicbot_stream_stalls_total', 'Streams whose played time stopped advancing'))
+STREAM_RECOVERIES = registry.register(Counter(
+    'musicbot_stream_recoveries_total', 'Stream recovery runs by trigger and outcome'))
+STREAM_RECOVERY_SECONDS = registry.register(Histogram(
+    'musicbot_stream_recovery_seconds', 'Time from a stream failure to playing again'))
+
+class StreamSupervisor:
+    """Detects failed and stalled streams and retries them with backoff before giving up on the song"""
+
+    def __init__(self, interval=STALL_CHECK_INTERVAL, stall_timeout=STALL_TIMEOUT,
+                 max_attempts=STREAM_MAX_RETRIES, backoff=STREAM_RETRY_BACKOFF):
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        # chat_id -> (song, played time, when it last advanced)
+        self.progress = {}
+        self.paused = set()
+        self.recovering = set()
+        self.backend = None
+        self.playing = None
+        self.restart = None
+        self.stalled = None
+
+    def bind(self, backend, playing, restart, stalled):
+        """playing: {chat_id: song}; restart(chat_id, attempt, position) -> bool;
+        stalled(chat_id, song, position): runs recover() (or moves on) where playback changes are serialized"""
+        self.backend = backend
+        self.playing = playing
+        self.restart = restart
+        self.stalled = stalled
+
+    def pause(self, chat_id):
+        self.paused.add(chat_id)
+
+    def resume(self, chat_id):
+        self.paused.discard(chat_id)
+        # Time spent paused is not a stall
+        self.progress.pop(chat_id, None)
+
+    async def recover(self, chat_id, reason, position=0):
+        """Run restart attempts with exponential backoff; True once the chat plays again"""
+        if chat_id in self.recovering:
+            return False
+        self.recovering.add(chat_id)
+        started = time.perf_counter()
+        try:
+            for attempt in range(self.max_attempts):
+                if attempt:
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+                if await self.restart(chat_id, attempt, position):
+                    STREAM_RECOVERIES.inc(reason=reason, result='recovered')
+                    STREAM_RECOVERY_SECONDS.observe(time.perf_counter() - started)
+                    return True
+            STREAM_RECOVERIES.inc(reason=reason, result='gave_up')
+            return False
+        finally:
+            self.recovering.discard(chat_id)
+            self.progress.pop(chat_id, None)
+
+    def start(self):
+        asyncio.ensure_future(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for chat_id in [c for c in self.progress if c not in self.playing]:
+                del self.progress[chat_id]
+            self.paused.intersection_update(self.playing)
+            chats = [c for c in self.playing if c not in self.paused and c not in self.recovering]
+            await asyncio.gather(*(self._check(chat_id) for chat_id in chats))
+
+    async def _check(self, chat_id):
+        song = self.playing.get(chat_id)
+        try:
+            played = await asyncio.wait_for(self.backend.played_time(chat_id), self.interval)
+        except NotInGroupCallError:
+            # Between songs, or the call was left; nothing to supervise
+            return
+        except Exception as e:
+            logger.debug(f"played_time failed in {chat_id}: {e}")
+            return
+        now = time.monotonic()
+        entry = self.progress.get(chat_id)
+        if entry is None or entry[0] is not song or played is None or played > entry[1]:
+            self.progress[chat_id] = (song, played, now)
+            return
+        if now - entry[2] < self.stall_timeout or chat_id in self.recovering:
+            return
+        STREAM_STALLS.inc()
+        logger.warning(f"Stream stalled in {chat_id} at {played}s ({song.title if song else '?'}), recovering")
+        asyncio.ensure_future(self._recover_stalled(chat_id, song, played or 0))
+
+    async def _recover_stalled(self, chat_id, song, position):
+        try:
+            await self.stalled(chat_id, song, position)
+        except Exception as e:
+            logger.error(f"Stall recovery failed in {chat_id}: {e}")
+
+# Global instance
+supervisor = StreamSupervisor()
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+from pytgcalls.exceptions import NotInGroupCallError
+from assistants import assistants, AssistantNotInChat
+from streaming import LocalBackend
+from logs import setup_logging
+from config import SESSION_STRINGS
+
+# Streaming worker process, started by streaming.ProcessBackend as: python workers.py <index> <count>
+# Jobs arrive as JSON lines on stdin; results and stream-end events go back as JSON lines on stdout.
+
+logger = logging.getLogger(__name__)
+
+class WorkerServer:
+    """Runs the frontend's jobs against this worker's assistants"""
+
+    def __init__(self, backend, out):
+        self.backend = backend
+        self.out = out
+        # Jobs for one chat run in arrival order; different chats run concurrently
+        self.locks = defaultdict(asyncio.Lock)
+
+    def send(self, message):
+        self.out.write(json.dumps(message).encode() + b'\n')
+
+    async def stream_ended(self, chat_id):
+        self.send({'event': 'stream_end', 'chat_id': chat_id})
+
+    async def handle(self, job):
+        chat_id = job['chat_id']
+        async with self.locks[chat_id]:
+            try:
+                op = job['op']
+                if op == 'play':
+                    result = await self.backend.play(chat_id, job['url'], job.get('invite_link'),
+                                                     job.get('seek', 0), job.get('quality', 'high'))
+                elif op == 'pause':
+                    result = await self.backend.pause(chat_id)
+                elif op == 'resume':
+                    result = await self.backend.resume(chat_id)
+                elif op == 'played_time':
+                    result = await self.backend.played_time(chat_id)
+                elif op == 'leave':
+                    result = await self.backend.leave(chat_id)
+                else:
+                    raise ValueError(f"unknown job {op!r}")
+                self.send({'id': job['id'], 'result': result})
+            except Exception as e:
+                if not isinstance(e, (ConnectionError, AssistantNotInChat, NotInGroupCallError)):
+                    logger.warning(f"Job {job.get('op')} failed in {chat_id}: {type(e).__name__}: {e}")
+                self.send({'id': job['id'], 'error': type(e).__name__, 'message': str(e)})
+
+    async def serve(self, reader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                job = json.loads(line)
+            except ValueError:
+                logger.warning(f"Invalid job line: {line[:200]!r}")
+                continue
+            asyncio.ensure_future(self.handle(job))
+
+        # stdin closed: the frontend is shutting down
+        for chat_id in list(self.backend.pool.assignments):
+            try:
+                await self.backend.leave(chat_id)
+            except Exception:
+                pass
+
+async def main(index, count, out):
+    # Clients are created here so they bind to this process's event loop
+    assistants.add_sessions(SESSION_STRINGS[index::count], prefix=f"worker{index}_assistant")
+    backend = LocalBackend(assistants)
+    server = WorkerServer(backend, out)
+    backend.on_stream_end(server.stream_ended)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=2**20)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+    await backend.start()
+    logger.info(f"Streaming worker {index}/{count} ready with {len(assistants.assistants)} assistants")
+    await server.serve(reader)
+
+if __name__ == "__main__":
+    index, count = int(sys.argv[1]), int(sys.argv[2])
+    # Replies go out on a private copy of stdout; anything else printed (e.g. Pyrogram's banner) lands on stderr
+    out = os.fdopen(os.dup(1), 'wb', buffering=0)
+    os.dup2(2, 1)
+    # stderr only: the frontend already owns the log file
+    setup_logging(filename=None, tag=f"worker{index}")
+    asyncio.run(main(index, count, out))